@@ -1,8 +1,14 @@
+from collections import deque
+
 import chess
+import cv2
+import numpy as np
 
 from board.change import Change
-from board.piece import Piece, piece_to_promotion, possible_promotions, filter_promotions
+from board.piece import Piece, piece_to_promotion, possible_promotions, filter_promotions, piece_from_chess, piece_name, \
+    piece_to_chess, class_pieces, piece_classes
 from board.square import Square
+from detections import Detections
 
 leftmost_square_from_pieces = {
     ('black', 'black'): 'h8',
@@ -20,6 +26,10 @@ unindexed_to_indexed = {
     'a8': lambda horizontal, vertical: (file_names[8 - vertical], 8 - horizontal),
 }
 
+# Classes of the per-square belief, ordered like python-chess piece types: empty, white pieces, black pieces
+belief_classes = [piece_name(piece) for piece in class_pieces]
+belief_class_index = {name: index for index, name in enumerate(belief_classes)}
+
 file_names = {
     1: 'a',
     2: 'b',
@@ -32,20 +42,15 @@ file_names = {
 }
 
 
-def _get_board_without_names(square_corners):
-    unindexed_board = [[0 for i in range(8)] for j in range(8)]
-
-    for horizont_index in range(8):
-        for vert_index in range(8):
-            square_corners_index_base = 9 * horizont_index + vert_index
-            unindexed_board[horizont_index][vert_index] = [
-                square_corners[square_corners_index_base],  # top_left
-                square_corners[square_corners_index_base + 9],  # top_right
-                square_corners[square_corners_index_base + 1],  # bottom_left
-                square_corners[square_corners_index_base + 10]  # bottom_right
-            ]
-
-    return unindexed_board
+# Indices into the 81 square corners of every square's top_left, top_right, bottom_left and bottom_right corner
+def _get_corner_indices(horizont_index, vert_index):
+    square_corners_index_base = 9 * horizont_index + vert_index
+    return np.array([
+        square_corners_index_base,
+        square_corners_index_base + 9,
+        square_corners_index_base + 1,
+        square_corners_index_base + 10
+    ])
 
 
 def get_enum_member_by_value(enum_class, value):
@@ -89,87 +94,268 @@ def _get_initial_piece(file, rank):
     return Piece.empty
 
 
-def get_predictions_in_square(square, predictions):
-    results = []
-    for prediction in predictions:
-        if square.is_point_in_square(prediction.point[0], prediction.point[1]):
-            results.append(prediction)
-    return results
-
-
 class Board:
-    board = {}
-
-    def __init__(self, square_corners, leftmost_piece_color, rightmost_piece_color):
-        self._index_board(square_corners, leftmost_piece_color, rightmost_piece_color)
-
-    def _index_board(self, square_corners, leftmost_piece_color, rightmost_piece_color):
+    """Board state as a 64 entry int8 array of piece classes (see `class_pieces`) in python-chess square order,
+    with bitboards kept alongside it.
+
+    The 81x2 square corners are a read-only float32 array shared by all squares. Snapshots share the piece
+    array until the board changes again (copy on write), and every `update_board` keeps one in `history`, so
+    the last `history_size` plies can be rolled back in O(1).
+    """
+
+    def __init__(self, square_corners, leftmost_piece_color, rightmost_piece_color, history_size=32):
+        self.corners = np.array(square_corners, dtype=np.float32).reshape(81, 2)
+        self.corners.setflags(write=False)
+
+        self.pieces = np.zeros(64, dtype=np.int8)
+        self._pieces_shared = False
+        # Same square indexing as python-chess: occupied_co[chess.WHITE], pieces_mask[chess.PAWN], ...
+        self.occupied = 0
+        self.occupied_co = [0, 0]
+        self.pieces_mask = [0] * 7
+        self.history = deque(maxlen=history_size)
+
+        self._index_board(leftmost_piece_color, rightmost_piece_color)
+        self.reset_belief()
+
+    def _index_board(self, leftmost_piece_color, rightmost_piece_color):
         starting_square = leftmost_square_from_pieces[(leftmost_piece_color, rightmost_piece_color)]
-        unindexed_board = _get_board_without_names(square_corners)
 
         indexed_board = {}
+        # Square coordinate of every cell of the square corners grid, grid_coords[horizontal][vertical]
+        grid_coords = [[None for i in range(8)] for j in range(8)]
         for horizont_index in range(8):
             for vert_index in range(8):
                 file, rank = unindexed_to_indexed[starting_square](horizont_index, vert_index)
+                coord = file + str(rank)
 
-                square = Square(unindexed_board[horizont_index][vert_index])
+                square = Square(self, chess.parse_square(coord), coord, _get_corner_indices(horizont_index, vert_index))
                 square.piece = _get_initial_piece(file, rank)
-                square.square_coords = unindexed_board[horizont_index][vert_index]
-                square.predicted = False
-                square.coord = (file + str(rank))
 
-                indexed_board[(file + str(rank))] = square
+                indexed_board[coord] = square
+                grid_coords[horizont_index][vert_index] = coord
 
         self.board = indexed_board
+        self.grid_coords = grid_coords
+
+        # Square centers in python-chess square order
+        self.square_centers = np.zeros((64, 2), dtype=np.float32)
+        for square in indexed_board.values():
+            self.square_centers[square.index] = np.mean(square.square_coords, axis=0)
+
+        # Maps image points to the square corners grid, where cell (horizontal, vertical) spans [h, h + 1) x [v, v + 1)
+        grid = np.float32([[horizont_index, vert_index] for horizont_index in range(9) for vert_index in range(9)])
+        self.image_to_grid, _ = cv2.findHomography(self.corners, grid)
+        # python-chess square of every grid cell, grid_squares[horizontal, vertical]
+        self.grid_squares = np.array([[chess.parse_square(coord) for coord in column] for column in grid_coords])
+        self._prediction_index = None
+
+    def set_piece(self, square_index, piece):
+        if self._pieces_shared:
+            self.pieces = self.pieces.copy()
+            self._pieces_shared = False
+
+        self._toggle_piece(square_index, class_pieces[self.pieces[square_index]])
+        self._toggle_piece(square_index, piece)
+        self.pieces[square_index] = piece_classes[piece]
+
+    def snapshot(self):
+        # The piece array is shared until the next set_piece copies it
+        self._pieces_shared = True
+        return self.pieces, self.occupied, tuple(self.occupied_co), tuple(self.pieces_mask)
+
+    def restore(self, snapshot):
+        self.pieces, self.occupied, occupied_co, pieces_mask = snapshot
+        self._pieces_shared = True
+        self.occupied_co = list(occupied_co)
+        self.pieces_mask = list(pieces_mask)
+
+    def rollback(self, plies=1):
+        """Undo the last `plies` calls of update_board, returns False if the history does not reach back that far."""
+        if plies > len(self.history):
+            return False
+        for i in range(plies - 1):
+            self.history.pop()
+        self.restore(self.history.pop())
+        return True
+
+    def find_earlier_position(self, predictions, max_plies=None):
+        """Plies back to the position in the history whose occupancy signature (occupied, white and black
+        bitboards) the predictions show, None if there is no such position."""
+        occupied, white, black = self.observed_bitboards(predictions)
+        for plies, (pieces, history_occupied, occupied_co, pieces_mask) in enumerate(reversed(self.history), 1):
+            if max_plies is not None and plies > max_plies:
+                break
+            if (history_occupied, occupied_co[chess.WHITE], occupied_co[chess.BLACK]) == (occupied, white, black):
+                return plies
+        return None
+
+    def _toggle_piece(self, square_index, piece):
+        chess_piece = piece_to_chess(piece)
+        if chess_piece is None:
+            return
+        mask = chess.BB_SQUARES[square_index]
+        self.occupied ^= mask
+        self.occupied_co[chess_piece.color] ^= mask
+        self.pieces_mask[chess_piece.piece_type] ^= mask
+
+    def matches_game(self, game):
+        return self.occupied_co == [game.occupied_co[chess.BLACK], game.occupied_co[chess.WHITE]] and all(
+            self.pieces_mask[piece_type] ==
+            game.pieces_mask(piece_type, chess.WHITE) | game.pieces_mask(piece_type, chess.BLACK)
+            for piece_type in chess.PIECE_TYPES
+        )
+
+    def observed_bitboards(self, predictions):
+        """Occupied, white and black bitboards of the squares holding predictions."""
+        occupied = white = black = 0
+        names = predictions.class_names()
+        for square_index, inside in enumerate(self.predictions_by_square(predictions)):
+            if len(inside) == 0:
+                continue
+            mask = chess.BB_SQUARES[square_index]
+            occupied |= mask
+            for name in names[inside]:
+                if name.startswith('white'):
+                    white |= mask
+                elif name.startswith('black'):
+                    black |= mask
+        return occupied, white, black
+
+    def changed_bitboards(self, predictions, snapshot=None):
+        """Bitboards of the squares which became occupied, became empty and changed piece color.
+
+        A square keeps its color as long as any of its predictions has the color of its piece. Changes are
+        relative to `snapshot` if given, otherwise to the current state.
+        """
+        if snapshot is None:
+            board_occupied, board_occupied_co = self.occupied, self.occupied_co
+        else:
+            pieces, board_occupied, board_occupied_co, pieces_mask = snapshot
+
+        occupied, white, black = self.observed_bitboards(predictions)
+        appeared = occupied & ~board_occupied
+        vanished = board_occupied & ~occupied
+        recolored = occupied & (board_occupied_co[chess.WHITE] & ~white | board_occupied_co[chess.BLACK] & ~black)
+        return appeared, vanished, recolored
+
+    def square_indices(self, xs, ys):
+        """python-chess square of every image point, -1 for points outside the board."""
+        squares = np.full(len(xs), -1, dtype=np.int64)
+        if len(xs) == 0:
+            return squares
+
+        points = np.stack([xs, ys], axis=1).astype(np.float32).reshape(-1, 1, 2)
+        cells = np.floor(cv2.perspectiveTransform(points, self.image_to_grid).reshape(-1, 2)).astype(np.int64)
+        on_board = ((cells >= 0) & (cells < 8)).all(axis=1)
+        squares[on_board] = self.grid_squares[cells[on_board, 0], cells[on_board, 1]]
+        return squares
+
+    def predictions_by_square(self, predictions):
+        """Indices of the predictions on each square, a list of 64 arrays in python-chess square order.
+
+        The index of the last predictions is kept, so further lookups for the same frame are free.
+        """
+        prediction_index = self._prediction_index
+        if prediction_index is not None and prediction_index[0] is predictions:
+            return prediction_index[1]
+
+        squares = self.square_indices(predictions.x, predictions.y)
+        order = np.argsort(squares, kind='stable')
+        bounds = np.searchsorted(squares[order], np.arange(65))
+        by_square = [order[bounds[i]:bounds[i + 1]] for i in range(64)]
+
+        self._prediction_index = (predictions, by_square)
+        return by_square
+
+    def get_predictions_in_square(self, square, predictions):
+        return predictions[self.predictions_by_square(predictions)[square.index]]
+
+    def reset_belief(self, prior=0.5):
+        """Start a new 64x13 belief from the current board state.
+
+        Every square believes its current piece with probability `prior`, the rest is spread over the other classes.
+        """
+        self.belief = np.full((64, len(belief_classes)), (1 - prior) / (len(belief_classes) - 1))
+        self.belief[np.arange(64), self.pieces] = prior
+        self.fused_frames = 0
+
+    def observation_likelihood(self, predictions, empty_likelihood=0.8):
+        """64x13 likelihood of one frame of detections for every square and belief class.
+
+        The most confident detection in a square is weighted by its confidence, a square without detections
+        observes empty with probability `empty_likelihood`.
+        """
+        other_classes = len(belief_classes) - 1
+        likelihood = np.full(self.belief.shape, (1 - empty_likelihood) / other_classes)
+        likelihood[:, 0] = empty_likelihood
+
+        names = predictions.class_names()
+        known = np.array([name in belief_class_index for name in names], dtype=bool)
+        for square_index, inside in enumerate(self.predictions_by_square(predictions)):
+            inside = inside[known[inside]]
+            if len(inside) == 0:
+                continue
+
+            best = inside[np.argmax(predictions.conf[inside])]
+            conf = float(np.clip(predictions.conf[best], 0.05, 0.99))
+            row = likelihood[square_index]
+            row[:] = (1 - conf) / other_classes
+            row[belief_class_index[names[best]]] = conf
+
+        return likelihood
+
+    # Fuse one frame of detections into the belief
+    def update_belief(self, predictions, empty_likelihood=0.8):
+        self.belief *= self.observation_likelihood(predictions, empty_likelihood)
+        self.belief /= self.belief.sum(axis=1, keepdims=True)
+        self.fused_frames += 1
+
+    # Most likely piece of every occupied square as detections at the square centers, for get_changed_squares
+    def belief_detections(self):
+        classes = self.belief.argmax(axis=1)
+        confidences = self.belief.max(axis=1)
+        occupied = classes != 0
+        centers = self.square_centers[occupied]
+
+        return Detections(
+            centers[:, 0].astype(np.int32),
+            centers[:, 1].astype(np.int32),
+            classes[occupied].astype(np.int32),
+            confidences[occupied].astype(np.float32),
+            belief_classes
+        )
 
     def get_changed_squares(self, predictions):
+        appeared, vanished, recolored = self.changed_bitboards(predictions)
+
         changed_squares = []
         for square in self.board.values():
-            square_updated = False
+            mask = chess.BB_SQUARES[square.index]
             square.change = None
-            for prediction in predictions:
-                if square.is_point_in_square(prediction.point[0], prediction.point[1]):
-                    if not square_updated and square.is_empty():
-                        print('prediction found, square went from empty to piece ' + square.coord)
-                        square.change = Change.empty_to_occupied
-                        changed_squares.append(square)
-                        square_updated = True
-                        break
-
-                    if prediction.name.startswith('white'):
-                        if square.piece.value[0].startswith('black'):
-                            print('prediction found, square went from black to white ' + square.coord)
-                            square.change = Change.color_change
-                            changed_squares.append(square)
-                            square_updated = True
-                            break
-
-                    if prediction.name.startswith('black'):
-                        if square.piece.value[0].startswith('white'):
-                            print('prediction found, square went from white to black ' + square.coord)
-                            square.change = Change.color_change
-                            changed_squares.append(square)
-                            square_updated = True
-                            break
-
-                    if prediction.name.split('-')[0] == square.piece.value[0].split('-')[0]:
-                        # print('prediction found, square unchanged ' + square.coord)
-                        square.change = None
-                        square_updated = True
-                        break
-
-            if not square.is_empty() and not square_updated:
+            if appeared & mask:
+                print('prediction found, square went from empty to piece ' + square.coord)
+                square.change = Change.empty_to_occupied
+            elif recolored & mask:
+                if self.occupied_co[chess.BLACK] & mask:
+                    print('prediction found, square went from black to white ' + square.coord)
+                else:
+                    print('prediction found, square went from white to black ' + square.coord)
+                square.change = Change.color_change
+            elif vanished & mask:
                 print('prediction not found, square went from piece to empty ', square.coord)
-                changed_squares.append(square)
                 square.change = Change.occupied_to_empty
 
+            if square.change is not None:
+                changed_squares.append(square)
+
         return changed_squares
 
     def update_board(self, update_squares):
+        self.history.append(self.snapshot())
         for square in update_squares:
             print(square.coord + ': ' + square.piece.value[0] + '->' + square.new_piece.value[0])
             square.piece = square.new_piece
-            self.board[square.coord] = square
 
     def get_move(self, changed_squares, predictions, legal_moves):
         from_square = None
@@ -187,6 +373,10 @@ class Board:
                 if changed_square.piece == Piece.blackRook or changed_square.piece == Piece.whiteRook:
                     rook_square = changed_square
 
+            # Four changes without a king and a rook are not castling, e.g. after missed moves
+            if king_square is None or rook_square is None:
+                return None
+
             # White castled
             if king_square.coord == 'e1':
                 # Long castle
@@ -265,27 +455,6 @@ class Board:
 
                 return from_square.coord + to_square.coord, [from_square, to_square, square_to_empty]
 
-        # Try to fix position if detected 3 changes, but only 2 of them are valid
-        if len(changed_squares) == 3:
-            # If to_square was not found in en_passant, means it should be a color change.
-            if to_square is None:
-                for changed_square in changed_squares:
-                    if changed_square.change == Change.color_change:
-                        to_square = changed_square
-
-            for changed_square in changed_squares:
-                # Starting square will always be empty
-                if changed_square.change == Change.occupied_to_empty:
-                    # if move_uci is not in legal moves, means it is not the starting square
-                    move = chess.Move.from_uci(changed_square.coord + to_square.coord)
-                    if move not in legal_moves:
-                        print('Removed square, as it cannot be the starting square: ', changed_square.coord)
-                        changed_squares.remove(changed_square)
-
-            # If failed to find invalid starting square, let it fail
-            if len(changed_squares) != 2:
-                return
-
         # move piece or capture piece
         if len(changed_squares) == 2:
             square_a, square_b = changed_squares
@@ -308,7 +477,7 @@ class Board:
                     (to_square_rank == '8' or to_square_rank == '1') and
                     (to_square.new_piece == Piece.blackPawn or to_square.new_piece == Piece.whitePawn)
             ):
-                detected_promotions = get_predictions_in_square(to_square, predictions)
+                detected_promotions = self.get_predictions_in_square(to_square, predictions)
                 print('detected promotion')
                 highest_conf = -1
                 highest_conf_pred = predictions[0].conf
@@ -323,5 +492,18 @@ class Board:
 
             return move_uci, [from_square, to_square]
 
+    # Squares whose piece changes when `move` is played in `game`, with new_piece set for update_board
+    def squares_for_move(self, move, game):
+        after = game.copy(stack=False)
+        after.push(move)
+
+        update_squares = []
+        for square in self.board.values():
+            new_piece = piece_from_chess(after.piece_at(square.index))
+            if new_piece != square.piece:
+                square.new_piece = new_piece
+                update_squares.append(square)
+        return update_squares
+
     def get_square(self, coord):
         return self.board[coord]
@@ -1,5 +1,7 @@
 from enum import Enum
 
+import chess
+
 
 class Piece(Enum):
     whitePawn = 'white-pawn',
@@ -35,3 +37,36 @@ def piece_to_promotion(piece):
             return 'b'
         case 'rook':
             return 'r'
+
+
+def piece_name(piece):
+    if piece is Piece.empty:
+        return 'empty'
+    return piece.value[0]
+
+
+def piece_from_chess(chess_piece):
+    if chess_piece is None:
+        return Piece.empty
+    color = 'white' if chess_piece.color == chess.WHITE else 'black'
+    return _pieces_by_name[color + '-' + chess.piece_name(chess_piece.piece_type)]
+
+
+def piece_to_chess(piece):
+    if piece is Piece.empty:
+        return None
+    return _chess_pieces[piece]
+
+
+_pieces_by_name = {piece.value[0]: piece for piece in Piece if piece is not Piece.empty}
+_chess_pieces = {
+    piece: chess.Piece(chess.PIECE_NAMES.index(name.split('-')[1]), name.startswith('white'))
+    for name, piece in _pieces_by_name.items()
+}
+
+# Piece of every int8 value of Board.pieces: empty, then the white and black pieces in python-chess piece type order
+class_pieces = [Piece.empty] + [
+    _pieces_by_name[color + '-' + chess.piece_name(piece_type)] for color in ('white', 'black')
+    for piece_type in chess.PIECE_TYPES
+]
+piece_classes = {piece: index for index, piece in enumerate(class_pieces)}
@@ -1,41 +1,35 @@
-from board.piece import Piece
+from board.piece import class_pieces
 
 
 class Square:
-    square_coords = []
-    piece = None
-    predicted = False
-    coord = ''
-    change = None
-    new_piece = None
-
-    def __init__(self, square_coords):
-        self.square_coords = square_coords
+    """View of one square of a `Board`. The piece lives in `Board.pieces` and the corners in `Board.corners`,
+    the square itself only holds its indices and the transient state of move decoding.
+    """
+    __slots__ = ('board', 'index', 'coord', 'corner_indices', 'change', 'new_piece')
+
+    def __init__(self, board, index, coord, corner_indices):
+        self.board = board
+        self.index = index
+        self.coord = coord
+        # top_left, top_right, bottom_left, bottom_right
+        self.corner_indices = corner_indices
+        self.change = None
+        self.new_piece = None
+
+    @property
+    def square_coords(self):
+        return self.board.corners[self.corner_indices]
+
+    @property
+    def piece(self):
+        return class_pieces[self.board.pieces[self.index]]
+
+    @piece.setter
+    def piece(self, piece):
+        self.board.set_piece(self.index, piece)
 
     def set_piece(self, piece):
         self.piece = piece
 
     def is_empty(self):
-        return self.piece is Piece.empty
-
-    def is_point_in_square(self, x, y):
-        top_left, top_right, bottom_left, bottom_right = self.square_coords
-
-        top_left_x, top_left_y = top_left
-        bottom_right_x, bottom_right_y = bottom_right
-        bottom_left_x, bottom_left_y = bottom_left
-        top_right_x, top_right_y = top_right
-
-        if x < top_left_x and x < bottom_left_x:
-            return False
-
-        if y < top_left_y and y < top_right_y:
-            return False
-
-        if x > top_right_x and x > bottom_right_x:
-            return False
-
-        if y > bottom_left_y and y > bottom_right_y:
-            return False
-
-        return True
\ No newline at end of file
+        return self.board.pieces[self.index] == 0
@@ -0,0 +1,101 @@
+import chess
+import cv2
+import numpy as np
+
+
+def move_squares(move, game):
+    """Squares whose content changes when `move` is played: from and to squares, the rook squares when castling
+    and the captured pawn square for en passant.
+    """
+    squares = {move.from_square, move.to_square}
+    if game.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        if chess.square_file(move.to_square) == 6:
+            squares |= {chess.square(7, rank), chess.square(5, rank)}
+        else:
+            squares |= {chess.square(0, rank), chess.square(3, rank)}
+    elif game.is_en_passant(move):
+        squares.add(chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square)))
+    return squares
+
+
+def match_move(changed_coords, game):
+    """Legal move explaining exactly the changed squares, or None if there is no single such move.
+
+    Every changed square has to be explained, so a shadow or weak difference leads to the detector instead of a
+    wrong move. Promotions are always ambiguous, as the promoted piece cannot be seen in a pixel difference.
+    """
+    changed = {chess.parse_square(coord) for coord in changed_coords}
+    matching = [move for move in game.legal_moves if move_squares(move, game) == changed]
+    if len(matching) != 1:
+        return None
+    return matching[0]
+
+
+class BoardDiff:
+    """Per-square pixel difference between the rectified board of the previous move and a new frame.
+    """
+
+    def __init__(self, square_corners, grid_coords, square_size=32, threshold=12.0, quiet_threshold=6.0,
+                 max_candidates=6):
+        self.square_size = square_size
+        self.threshold = threshold
+        self.quiet_threshold = quiet_threshold
+        self.max_candidates = max_candidates
+        self.coords = np.array(grid_coords)
+
+        grid = np.float32([[square_size * i, square_size * j] for i in range(9) for j in range(9)])
+        self.transform, _ = cv2.findHomography(np.float32(square_corners).reshape(-1, 2), grid)
+
+        self.reference = None
+        self.pending = None
+
+    def rectify(self, img):
+        size = 8 * self.square_size
+        board = cv2.warpPerspective(img, self.transform, (size, size), flags=cv2.INTER_AREA)
+        board = cv2.cvtColor(board, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(board, (5, 5), 0).astype(np.float32)
+
+    def set_reference(self, img):
+        self.reference = self.rectify(img)
+        self.pending = None
+
+    # Makes the board of `img` the reference on the next commit, when there is no reference to compare it with yet
+    def set_pending(self, img):
+        self.pending = self.rectify(img)
+
+    # Drops the reference once it no longer shows the position of the game, see set_pending
+    def reset(self):
+        self.reference = None
+        self.pending = None
+
+    # Makes the board of the last `candidates` call the reference, once its move has been accepted
+    def commit(self):
+        if self.pending is not None:
+            self.reference = self.pending
+            self.pending = None
+
+    def square_energies(self, img):
+        board = self.rectify(img)
+        self.pending = board
+
+        size = self.square_size
+        diff = np.abs(board - self.reference)
+        # Rows of the rectified image are the vertical grid index, columns the horizontal one
+        return diff.reshape(8, size, 8, size).mean(axis=(1, 3)).T
+
+    def candidates(self, img):
+        """Squares ranked by difference energy, limited to those above the threshold.
+
+        Returns a list of (coord, energy) pairs and the coords of unclear squares, whose energy lies between
+        `quiet_threshold` and `threshold`. A weakly visible change may be one of those, so the candidates alone
+        should not be trusted when there are any.
+        """
+        energies = self.square_energies(img)
+        order = np.argsort(energies, axis=None)[::-1][:self.max_candidates]
+        candidates = [
+            (str(self.coords.flat[i]), float(energies.flat[i]))
+            for i in order if energies.flat[i] > self.threshold
+        ]
+        unclear = (energies > self.quiet_threshold) & (energies <= self.threshold)
+        return candidates, [str(coord) for coord in self.coords[unclear]]
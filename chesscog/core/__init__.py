@@ -1,44 +1,41 @@
 import numpy as np
-#import torch
 import typing
 import functools
 from collections.abc import Iterable
 
-#: Device to be used for computation (GPU if available, else CPU).
-#DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-#
-#T = typing.Union[torch.Tensor, torch.nn.Module, typing.List[torch.Tensor],
-#                 tuple, dict, typing.Generator]
-#
-#
-#def device(x: T, dev: str = DEVICE) -> T:
-#    """Convenience method to move a tensor/module/other structure containing tensors to the device.
-#
-#    Args:
-#        x (T): the tensor (or strucure containing tensors)
-#        dev (str, optional): the device to move the tensor to. Defaults to DEVICE.
-#
-#    Raises:
-#        TypeError: if the type was not a compatible tensor
-#
-#    Returns:
-#        T: the input tensor moved to the device
-#    """
-#
-#    to = functools.partial(device, dev=dev)
-#    if isinstance(x, (torch.Tensor, torch.nn.Module)):
-#        return x.to(dev)
-#    elif isinstance(x, list):
-#        return list(map(to, x))
-#    elif isinstance(x, tuple):
-#        return tuple(map(to, x))
-#    elif isinstance(x, dict):
-#        return {k: to(v) for k, v in x.items()}
-#    elif isinstance(x, Iterable):
-#        return map(to, x)
-#    else:
-#        raise TypeError
-#
+def device(x, dev: str = None):
+    """Convenience method to move a tensor/module/other structure containing tensors to the device.
+
+    torch is imported on first use, so that corner detection does not depend on it.
+
+    Args:
+        x: the tensor (or strucure containing tensors)
+        dev (str, optional): the device to move the tensor to. Defaults to the GPU if available, else the CPU.
+
+    Raises:
+        TypeError: if the type was not a compatible tensor
+
+    Returns:
+        the input tensor moved to the device
+    """
+    import torch
+
+    if dev is None:
+        dev = "cuda" if torch.cuda.is_available() else "cpu"
+    to = functools.partial(device, dev=dev)
+    if isinstance(x, (torch.Tensor, torch.nn.Module)):
+        return x.to(dev)
+    elif isinstance(x, list):
+        return list(map(to, x))
+    elif isinstance(x, tuple):
+        return tuple(map(to, x))
+    elif isinstance(x, dict):
+        return {k: to(v) for k, v in x.items()}
+    elif isinstance(x, Iterable):
+        return map(to, x)
+    else:
+        raise TypeError
+
 
 def sort_corner_points(points: np.ndarray) -> np.ndarray:
     """Permute the board corner coordinates to the order [top left, top right, bottom right, bottom left].
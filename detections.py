@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class Prediction:
+    __slots__ = ('point', 'name', 'conf')
+
+    def __init__(self, point, name, conf):
+        self.point = point
+        self.name = name
+        self.conf = conf
+
+
+def bounding_box_bottom_middle(point_left, point_right):
+    x_left = point_left[0]
+    y_left = point_left[1]
+    x_right = point_right[0]
+    y_right = point_right[1]
+    height = y_left - y_right
+    return [int((x_left + x_right) * 0.5), y_right + int(height * 0.15)]
+
+
+class Detections:
+    """Columnar detection results, one numpy array per attribute instead of a Prediction object per box.
+
+    `x` and `y` hold the base point of every piece (see `bounding_box_bottom_middle`), `cls` the class id,
+    `conf` the confidence and `xyxy` the bounding box. `names` maps class ids to piece names. Iterating
+    or indexing with an integer yields `Prediction` objects for code which works with single pieces.
+    """
+    __slots__ = ('x', 'y', 'cls', 'conf', 'xyxy', 'names')
+
+    def __init__(self, x, y, cls, conf, names, xyxy=None):
+        self.x = x
+        self.y = y
+        self.cls = cls
+        self.conf = conf
+        self.names = names
+        self.xyxy = xyxy
+
+    @classmethod
+    def from_boxes(cls, xyxy, classes, confidences, names):
+        xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        corners = np.trunc(xyxy).astype(np.int32)
+        x = (corners[:, 0] + corners[:, 2]) // 2
+        height = corners[:, 1] - corners[:, 3]
+        y = corners[:, 3] + np.trunc(height * 0.15).astype(np.int32)
+        return cls(x, y, np.asarray(classes, dtype=np.int32), np.asarray(confidences, dtype=np.float32), names, xyxy)
+
+    @classmethod
+    def empty(cls, names):
+        return cls.from_boxes(np.empty((0, 4)), [], [], names)
+
+    @classmethod
+    def concatenate(cls, detections_list, names):
+        if len(detections_list) == 0:
+            return cls.empty(names)
+        return cls(
+            np.concatenate([d.x for d in detections_list]),
+            np.concatenate([d.y for d in detections_list]),
+            np.concatenate([d.cls for d in detections_list]),
+            np.concatenate([d.conf for d in detections_list]),
+            names,
+            np.concatenate([d.xyxy for d in detections_list])
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        xyxy = arrays['xyxy'] if 'xyxy' in arrays else None
+        names = [str(name) for name in arrays['names']]
+        return cls(arrays['x'], arrays['y'], arrays['cls'], arrays['conf'], names, xyxy)
+
+    def to_arrays(self):
+        arrays = {
+            'x': self.x, 'y': self.y, 'cls': self.cls, 'conf': self.conf, 'names': np.array(self.names, dtype=str)
+        }
+        if self.xyxy is not None:
+            arrays['xyxy'] = self.xyxy
+        return arrays
+
+    def __len__(self):
+        return len(self.cls)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Prediction([int(self.x[index]), int(self.y[index])], self.names[self.cls[index]],
+                              float(self.conf[index]))
+
+        return Detections(self.x[index], self.y[index], self.cls[index], self.conf[index], self.names,
+                          self.xyxy[index] if self.xyxy is not None else None)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def class_names(self):
+        return np.asarray(self.names, dtype=object)[self.cls]
+
+    def shifted(self, x, y):
+        xyxy = self.xyxy + np.float32([x, y, x, y]) if self.xyxy is not None else None
+        return Detections(self.x + x, self.y + y, self.cls, self.conf, self.names, xyxy)
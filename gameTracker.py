@@ -1,42 +1,170 @@
+import glob
+import json
 import os
+import threading
 import tkinter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
 
 import cairosvg
 import chess
+import chess.polyglot
 import chess.svg
 import cv2
+import numpy as np
 from PIL import ImageTk, Image
 
 import config
 from board.boardState import Board
+from boardDiff import BoardDiff, match_move, move_squares
+from detections import Detections
 from chesscog.corner_detection.detect_corners import find_corners
 from LiveChess2FEN.detectboard.detect_board import detect, compute_corners
-from predictor import Predictor
+from LiveChess2FEN.detectboard.laps import check_board_position
+from motion import MotionTrigger
+from moveDecoder import MoveTable, catch_up, decode_legal_move, score_moves
+from predictor import CascadePredictor, Predictor, board_roi, inference_size
+from resultCache import ResultCache
+from squareClassifier import SquareClassifier
 from webcam import VideoCapture
 
 
+# Settings used by chesscog's find_corners, part of its cache key
+CORNER_DETECTION_SETTINGS = ['RESIZE_IMAGE', 'EDGE_DETECTION', 'LINE_DETECTION', 'BORDER_REFINEMENT',
+                             'MAX_OUTLIER_INTERSECTION_POINT_RATIO_PER_LINE', 'RANSAC']
+
+# Tracker state checkpointed into the game directory after every move
+STATE_FILE = 'state.json'
+
+
 class ChessGameTracker:
-    webcam = VideoCapture(config.settings.CAMERA_URL)
     board_corners = []
     square_corners = []
+    inference_size = None
     move_index = 0
     game_save_path = ''
     game_directory = ''
-    predictor = Predictor('rtdetr')
     game = chess.Board()
     board = None
+    orientation = None
+    board_diff = None
+    motion_trigger = None
+    last_polled_frame = 0
+    pipeline = None
+    move_table = None
 
     def __init__(self, game_save_path, tkinter_instance):
         self.game_save_path = game_save_path
         self.tkinter_instance = tkinter_instance
+        # Camera and model are opened on first use (or by warm_up), so importing this module touches no hardware
+        self._webcam = None
+        self._predictor = None
+        self._square_classifier = None
+        self._cascade = None
+        self._init_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        # Held while the board and game change, so other threads can take a consistent snapshot of them
+        self.board_lock = threading.RLock()
+        self._move_table_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='move-table')
+
+        cache_settings = config.settings.CACHE
+        self.cache = None
+        if cache_settings.ENABLED:
+            self.cache = ResultCache(
+                max_bytes=cache_settings.MAX_MB * 1024 * 1024,
+                directory=cache_settings.DIRECTORY or None
+            )
+
+    # Runs a stage through the result cache if it is enabled, `compute` returns a dict of numpy arrays
+    def cached(self, stage, img, stage_config, compute):
+        if self.cache is None:
+            return compute()
+        return self.cache.get_or_compute(stage, img, stage_config, compute)
+
+    @property
+    def webcam(self):
+        with self._init_lock:
+            if self._webcam is None:
+                self._webcam = VideoCapture(config.settings.CAMERA_URL)
+            return self._webcam
+
+    @property
+    def predictor(self):
+        with self._init_lock:
+            if self._predictor is None:
+                self._predictor = Predictor(
+                    config.settings.PREDICTOR.MODEL_TYPE,
+                    roi_padding=config.settings.PREDICTOR.ROI_PADDING,
+                    intra_op_threads=config.settings.PREDICTOR.ONNX.INTRA_OP_THREADS,
+                    inter_op_threads=config.settings.PREDICTOR.ONNX.INTER_OP_THREADS,
+                    class_names=config.settings.PREDICTOR.ONNX.CLASS_NAMES
+                )
+            return self._predictor
+
+    @property
+    def square_classifier(self):
+        with self._init_lock:
+            if self._square_classifier is None:
+                self._square_classifier = SquareClassifier(
+                    config.settings.SQUARE_CLASSIFIER.WEIGHTS,
+                    model_name=config.settings.SQUARE_CLASSIFIER.MODEL,
+                    headroom=config.settings.SQUARE_CLASSIFIER.HEADROOM
+                )
+            return self._square_classifier
+
+    @property
+    def cascade(self):
+        predictor = self.predictor
+        with self._init_lock:
+            if self._cascade is None:
+                fast = Predictor(
+                    config.settings.PREDICTOR.CASCADE.FAST_MODEL_TYPE,
+                    roi_padding=config.settings.PREDICTOR.ROI_PADDING,
+                    intra_op_threads=config.settings.PREDICTOR.ONNX.INTRA_OP_THREADS,
+                    inter_op_threads=config.settings.PREDICTOR.ONNX.INTER_OP_THREADS,
+                    class_names=config.settings.PREDICTOR.ONNX.CLASS_NAMES
+                )
+                self._cascade = CascadePredictor(fast, predictor)
+            return self._cascade
+
+    def warm_up(self):
+        timings = {}
+
+        start = time.perf_counter()
+        predictor = self.predictor
+        timings['model_load'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        frame, age = self.webcam.read(timeout=config.settings.WARM_UP.CAMERA_TIMEOUT_S)
+        timings['camera_open'] = time.perf_counter() - start
+
+        # Same shape as the camera frames, so the first real move hits already initialized buffers
+        if frame is not None:
+            dummy = np.zeros_like(frame.image)
+        else:
+            print('No frame found while warming up')
+            dummy = np.zeros((1080, 1920, 3), np.uint8)
+
+        start = time.perf_counter()
+        predictor.detect(dummy)
+        if config.settings.PREDICTOR.CASCADE.ENABLED:
+            self.cascade.fast.detect(dummy)
+        timings['first_inference'] = time.perf_counter() - start
+
+        print('Warm-up: model load {} ms, camera open {} ms, first inference {} ms'.format(
+            *[round(timings[key] * 1000) for key in ('model_load', 'camera_open', 'first_inference')]))
+        return timings
 
     def reset_game(self):
         self.square_corners = []
         self.board_corners = []
+        self.inference_size = None
         self.move_index = 0
         self.game_save_path = ''
+        self.motion_trigger = None
+        self.board_diff = None
+        self.move_table = None
 
     def show_image(self, img):
         image = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -55,41 +183,162 @@ class ChessGameTracker:
         label_image.place(x=781, y=0)
 
     def _draw_pieces_points(self, img, pieces_points):
-        for piece_point in pieces_points:
-            cv2.circle(img, (piece_point.point[0], piece_point.point[1]), 10, (255, 0, 0), -1)
+        for x, y in zip(pieces_points.x, pieces_points.y):
+            cv2.circle(img, (int(x), int(y)), 10, (255, 0, 0), -1)
 
+    # Leaves img unannotated, as it becomes the pixel difference reference and is saved. Returns the detected pieces
+    # to be drawn with annotate
     def initialize_board(self, img):
         self.find_square_and_board_corners(img)
         predictions = self.predictor.detect(img)
         pieces_points = self.predictor.predictions_to_pieces_points(predictions)
         leftmost_box, rightmost_box, class_left, class_right = self.predictor.find_closest_pieces(pieces_points)
-        self._draw_pieces_points(img, pieces_points)
-        board = Board(self.square_corners, class_left.split('-')[0], class_right.split('-')[0])
+        self.create_board(img, class_left.split('-')[0], class_right.split('-')[0])
+        return pieces_points
+
+    def create_board(self, img, leftmost_piece_color, rightmost_piece_color):
+        self.orientation = (leftmost_piece_color, rightmost_piece_color)
+        board = Board(self.square_corners, leftmost_piece_color, rightmost_piece_color,
+                      history_size=config.settings.BOARD.HISTORY_PLIES)
         self.board = board
+        self.prepare_move_table()
+
+        if config.settings.PREFILTER.ENABLED:
+            self.board_diff = BoardDiff(
+                self.square_corners,
+                board.grid_coords,
+                square_size=config.settings.PREFILTER.SQUARE_SIZE,
+                threshold=config.settings.PREFILTER.THRESHOLD,
+                quiet_threshold=config.settings.PREFILTER.QUIET_THRESHOLD,
+                max_candidates=config.settings.PREFILTER.MAX_CANDIDATES
+            )
+            # Without a frame (restored state) the first tracked frame becomes the reference, see prefilter_move
+            if img is not None:
+                self.board_diff.set_reference(img)
 
     def find_square_and_board_corners(self, img):
 
         # Find board corners using chesscog
-        corners = find_corners(config.settings, img)
+        corner_settings = {key: config.settings.get(key) for key in CORNER_DETECTION_SETTINGS}
+        corners = self.cached(
+            'find_corners', img, corner_settings,
+            lambda: {'corners': find_corners(config.settings, img)}
+        )['corners']
+
         # Find board and square corners using LiveChess2FEN
-        board = detect(img, corners.astype(int).tolist())
-        bc, sc = compute_corners(board)
+        def compute_board_and_square_corners():
+            board = detect(img, corners.astype(int).tolist())
+            board_corners, square_corners = compute_corners(board)
+            return {'board_corners': board_corners, 'square_corners': square_corners}
+
+        corners = self.cached('compute_corners', img, corners.astype(int).tolist(), compute_board_and_square_corners)
+        bc, sc = corners['board_corners'], corners['square_corners']
 
         self.board_corners = bc
         self.square_corners = sc
+        self.inference_size = self.choose_inference_size(img.shape)
 
         return bc, sc
 
+    # Chosen once per calibration, the board does not move relative to the camera during a game
+    def choose_inference_size(self, img_shape):
+        adaptive_settings = config.settings.PREDICTOR.ADAPTIVE_SIZE
+        if not adaptive_settings.ENABLED:
+            return None
+
+        crop_shape = img_shape
+        if self.detection_roi() is not None:
+            x0, y0, x1, y1 = board_roi(img_shape, self.board_corners, self.predictor.roi_padding)
+            crop_shape = (y1 - y0, x1 - x0)
+
+        size = inference_size(
+            self.square_corners,
+            crop_shape,
+            target_square_size=adaptive_settings.TARGET_SQUARE_SIZE,
+            min_size=adaptive_settings.MIN_SIZE,
+            max_size=adaptive_settings.MAX_SIZE
+        )
+        print(f'Using detector input size {size}')
+        return size
+
+    def detection_roi(self):
+        if config.settings.PREDICTOR.BOARD_ROI and len(self.board_corners) != 0:
+            return self.board_corners
+        return None
+
     def make_game_directory(self):
         current_date_time = datetime.now().strftime("%Y%m%d-%H%M")
         self.game_directory = f'{self.game_save_path}/{current_date_time}'
         if not os.path.exists(self.game_directory):
             os.mkdir(f'{self.game_save_path}/{current_date_time}')
 
-    def save_game_move(self, image):
+    def save_game_move(self, image, move_index=None, game=None):
+        if move_index is None:
+            move_index = self.move_index
         if self.game_directory == '':
             self.make_game_directory()
-        cv2.imwrite(f'{self.game_directory}/{self.move_index}.jpg', image)
+        cv2.imwrite(f'{self.game_directory}/{move_index}.jpg', image)
+        if config.settings.STATE.ENABLED:
+            self.save_state(move_index, game)
+
+    def save_state(self, move_index=None, game=None):
+        if self.board is None:
+            return
+        if move_index is None:
+            move_index = self.move_index
+        if game is None:
+            game = self.game
+
+        state = {
+            'board_corners': np.asarray(self.board_corners).tolist(),
+            'square_corners': np.asarray(self.square_corners).tolist(),
+            'orientation': list(self.orientation),
+            'moves': [move.uci() for move in list(game.move_stack)],
+            'move_index': move_index,
+            'inference_size': self.inference_size,
+        }
+        path = os.path.join(self.game_directory, STATE_FILE)
+        with self._state_lock:
+            # Written under a temporary name first, so a crash never leaves a truncated state behind
+            with open(path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(path + '.tmp', path)
+
+    def restore_state(self, img=None):
+        """Continue the most recent saved game instead of detecting the board and starting a new game.
+
+        If `img` is given, the saved board corners are validated against it with LiveChess2FEN's
+        check_board_position first. Returns whether a state was restored.
+        """
+        paths = sorted(glob.glob(os.path.join(self.game_save_path, '*', STATE_FILE)))
+        if len(paths) == 0:
+            return False
+        with open(paths[-1]) as f:
+            state = json.load(f)
+
+        if img is not None:
+            found, cropped_img = check_board_position(img, state['board_corners'])
+            if not found:
+                print('Board moved since ' + paths[-1] + ' was saved, starting a new game')
+                return False
+
+        self.game_directory = os.path.dirname(paths[-1])
+        self.board_corners = state['board_corners']
+        self.square_corners = state['square_corners']
+        self.inference_size = state['inference_size']
+        self.move_index = state['move_index']
+        self.game = chess.Board()
+        for move in state['moves']:
+            self.game.push_uci(move)
+        # The move table is only built for the restored position, the board replays the moves to fill its history
+        self.create_board(img, *state['orientation'])
+        replay = chess.Board()
+        for move in self.game.move_stack:
+            self.board.update_board(self.board.squares_for_move(move, replay))
+            replay.push(move)
+
+        print('Restored {} moves from {}'.format(len(self.game.move_stack), paths[-1]))
+        return True
 
     def draw_corners(self, img):
         for corner in self.board_corners:
@@ -97,49 +346,370 @@ class ChessGameTracker:
         for corner in self.square_corners:
             cv2.circle(img, (int(corner[0]), int(corner[1])), 10, (0, 0, 255), -1)
 
-    def process_move(self):
+    # Copy of the frame to display, with the detected pieces and the corners drawn on it. The frame itself is saved
+    # unannotated, so reconstruct.py can detect on it again
+    def annotate(self, img, pieces_points=None, corners=True):
+        annotated = img.copy()
+        if pieces_points is not None:
+            self._draw_pieces_points(annotated, pieces_points)
+        if corners:
+            self.draw_corners(annotated)
+        return annotated
+
+    def poll_motion(self):
+        if len(self.board_corners) == 0:
+            return
+
+        frame, age = self.webcam.read(timeout=0)
+        if frame is None or frame.seq == self.last_polled_frame:
+            return
+        self.last_polled_frame = frame.seq
+
+        if self.motion_trigger is None:
+            trigger_settings = config.settings.MOTION_TRIGGER
+            self.motion_trigger = MotionTrigger(
+                self.board_corners,
+                size=trigger_settings.BOARD_SIZE,
+                pixel_threshold=trigger_settings.PIXEL_THRESHOLD,
+                motion_threshold=trigger_settings.MOTION_THRESHOLD,
+                still_threshold=trigger_settings.STILL_THRESHOLD,
+                change_threshold=trigger_settings.CHANGE_THRESHOLD,
+                still_frames=trigger_settings.STILL_FRAMES
+            )
+
+        if self.motion_trigger.update(frame.image):
+            print('Board settled after motion, processing move')
+            if self.pipeline is not None:
+                self.pipeline.submit(frame)
+            else:
+                self.process_move(frame)
+
+    # Copy of the game and snapshot of the board, for threads which must not see them change midway
+    def snapshot_state(self):
+        with self.board_lock:
+            return self.game.copy(stack=False), self.board.snapshot()
+
+    def detect_pieces(self, img):
+        # Once the squares are known, classifying 64 square crops is much cheaper than full frame detection.
+        # The crops only depend on the square corners, which never change after initialization
+        if config.settings.SQUARE_CLASSIFIER.ENABLED and self.board is not None:
+            return self.square_classifier.detect(img, self.board)
+
+        roi = self.detection_roi()
+
+        tiled_settings = config.settings.PREDICTOR.TILED
+        cascade_settings = config.settings.PREDICTOR.CASCADE
+        use_cascade = cascade_settings.ENABLED and self.board is not None
+        if use_cascade:
+            game, board_state = self.snapshot_state()
+
+        # The cascade runs full frame detection with both models, so TILED only applies without it
+        def compute_detections():
+            if use_cascade:
+                return self.cascade.detect_pieces(
+                    img, lambda pieces_points: self.detections_consistent(pieces_points, game, board_state),
+                    roi=roi, imgsz=self.inference_size
+                ).to_arrays()
+
+            if tiled_settings.ENABLED:
+                return self.predictor.detect_tiled(
+                    img, roi=roi, rows=tiled_settings.ROWS, cols=tiled_settings.COLS, overlap=tiled_settings.OVERLAP,
+                    iou=tiled_settings.IOU, imgsz=self.inference_size
+                ).to_arrays()
+
+            predictions = self.predictor.detect(img, roi=roi, imgsz=self.inference_size)
+            return self.predictor.predictions_to_pieces_points(predictions).to_arrays()
+
+        detector_config = {
+            'model_type': self.predictor.model_type,
+            'roi': np.asarray(roi).tolist() if roi is not None else None,
+            'roi_padding': self.predictor.roi_padding,
+            'imgsz': self.inference_size,
+            'tiled': tiled_settings if tiled_settings.ENABLED else None,
+            # Whether the fast detections are kept depends on the position they are checked against
+            'cascade': [
+                cascade_settings.FAST_MODEL_TYPE, cascade_settings.MIN_CONFIDENCE, chess.polyglot.zobrist_hash(game)
+            ] if use_cascade else None
+        }
+        return Detections.from_arrays(self.cached('detect', img, detector_config, compute_detections))
+
+    # Detections are trusted when every detected piece is confident and the changed squares form exactly one legal
+    # move. Promotions share their squares with the other promotions, so they always go to the accurate model.
+    # Runs on the detection thread against a snapshot of the game and board (see snapshot_state), so unlike
+    # get_changed_squares it leaves the board untouched
+    def detections_consistent(self, pieces_points, game, board_state):
+        min_confidence = config.settings.PREDICTOR.CASCADE.MIN_CONFIDENCE
+        for inside in self.board.predictions_by_square(pieces_points):
+            if len(inside) > 0 and pieces_points.conf[inside].max() < min_confidence:
+                return False
+
+        appeared, vanished, recolored = self.board.changed_bitboards(pieces_points, board_state)
+        changed = set(chess.SquareSet(appeared | vanished | recolored))
+        matching = [move for move in game.legal_moves if move_squares(move, game) == changed]
+        return len(matching) == 1
+
+    # Builds the move table of the current position in the background, while the players think
+    def prepare_move_table(self):
+        self.move_table = self._move_table_executor.submit(MoveTable, self.game.copy(stack=False))
+
+    # Move found by looking up the observed change signature in the move table, None if it is not there
+    def table_move(self, pieces_points):
+        if self.move_table is None:
+            return None
+        table = self.move_table.result()
+        if table.key != chess.polyglot.zobrist_hash(self.game):
+            return None
+
+        moves = table.lookup(self.board.changed_bitboards(pieces_points))
+        if len(moves) <= 1:
+            return moves[0] if len(moves) == 1 else None
+
+        # Promotions differ only in the piece detected on the promotion square, a queen unless detected otherwise
+        promotion = chess.QUEEN
+        to_square_predictions = self.board.predictions_by_square(pieces_points)[moves[0].to_square]
+        if len(to_square_predictions) > 0:
+            best = to_square_predictions[np.argmax(pieces_points.conf[to_square_predictions])]
+            piece_type = pieces_points.names[pieces_points.cls[best]].split('-')[-1]
+            if piece_type in chess.PIECE_NAMES:
+                promotion = chess.PIECE_NAMES.index(piece_type)
+        return next((move for move in moves if move.promotion == promotion), moves[0])
+
+    # Returns the decoded move, None if the detections showed moves being taken back
+    def decode_move(self, pieces_points):
+        move = self.table_move(pieces_points)
+        if move is not None:
+            print('Move {} found in the move table'.format(move.uci()))
+            return self.apply_move(move)
+
+        if config.settings.TAKEBACK.ENABLED and self.take_back(pieces_points):
+            return None
+
+        try:
+            if config.settings.MOVE_DECODER.ENABLED:
+                return self.decode_likely_move(pieces_points)
+            return self.decode_changed_squares(pieces_points)
+        except ValueError:
+            # Several moves may have been played since the last decoded one
+            if not config.settings.CATCH_UP.ENABLED:
+                raise
+            move = self.catch_up(pieces_points)
+            if move is None:
+                raise
+            return move
+
+    def decode_changed_squares(self, pieces_points):
+        changed_squares = self.board.get_changed_squares(pieces_points)
+        result = self.board.get_move(changed_squares, pieces_points, self.game.legal_moves)
+        if result is None:
+            raise ValueError('No move found for changed squares ' + ', '.join(s.coord for s in changed_squares))
+        move_uci, update_squares = result
+        move = chess.Move.from_uci(move_uci)
+        if move not in self.game.legal_moves:
+            raise ValueError('Decoded move {} is not legal'.format(move_uci))
+
+        self.game.push(move)
+        self.board.update_board(update_squares)
+        self.prepare_move_table()
+        if not self.board.matches_game(self.game):
+            print('Board state differs from the game after ' + move_uci)
+        return move
+
+    # Scores every legal move against the per-square detection likelihood instead of matching changed squares
+    def decode_likely_move(self, pieces_points):
+        decoder_settings = config.settings.MOVE_DECODER
+        likelihood = self.board.observation_likelihood(pieces_points, decoder_settings.EMPTY_LIKELIHOOD)
+        move, margin, runner_up = decode_legal_move(np.log(likelihood), self.game)
+        if move is None or margin < decoder_settings.MIN_MARGIN:
+            raise ValueError('No move found, best {} with margin {:.2f} over {}'.format(
+                move and move.uci(), margin, runner_up and runner_up.uci()
+            ))
+
+        print('Decoded {} with margin {:.2f} over {}'.format(move.uci(), margin, runner_up and runner_up.uci()))
+        return self.apply_move(move)
+
+    # Plays the sequence of up to CATCH_UP.MAX_PLIES moves best explaining the detections, returns its last move.
+    # Only runs once single move decoding failed, so a single move is never accepted here and a sequence has to
+    # explain the detections clearly better than the best single move
+    def catch_up(self, pieces_points):
+        catch_up_settings = config.settings.CATCH_UP
+        log_likelihood = np.log(self.board.observation_likelihood(pieces_points, catch_up_settings.EMPTY_LIKELIHOOD))
+        moves, gain = catch_up(
+            log_likelihood, self.game, max_plies=catch_up_settings.MAX_PLIES,
+            beam_width=catch_up_settings.BEAM_WIDTH, ply_penalty=catch_up_settings.PLY_PENALTY
+        )
+        if len(moves) < 2:
+            return None
+
+        single_moves, scores = score_moves(log_likelihood, self.game)
+        single_gain = max(scores.max() - catch_up_settings.PLY_PENALTY, 0.0) if len(single_moves) > 0 else 0.0
+        if gain - single_gain < catch_up_settings.MIN_MARGIN:
+            print('Not catching up with {}, margin {:.2f} over the best single move'.format(
+                ' '.join(move.uci() for move in moves), gain - single_gain
+            ))
+            return None
+
+        print('Catching up {} plies missed since the last move (log-likelihood gain {:.2f}), press z to undo '
+              'them one by one if they are wrong'.format(len(moves), gain))
+        for ply, move in enumerate(moves, 1):
+            print('Caught up ply {}/{}: {} {}'.format(ply, len(moves), self.game.fullmove_number, self.game.san(move)))
+            self.apply_move(move)
+        return moves[-1]
+
+    def decode_fused(self, pieces_points, next_frame=None):
+        """Decode the move from the per-square belief fused over several frames.
+
+        Starts with `pieces_points` and, while fewer than FUSION.MIN_FRAMES frames were fused or the move cannot be
+        decoded, detects another frame from `next_frame` (up to FUSION.MAX_FRAMES frames). Without `next_frame`, the
+        move is decoded from `pieces_points` as it is.
+        """
+        fusion_settings = config.settings.FUSION
+        if not fusion_settings.ENABLED:
+            return self.decode_move(pieces_points)
+
+        self.board.reset_belief(fusion_settings.PRIOR)
+        self.board.update_belief(pieces_points, fusion_settings.EMPTY_LIKELIHOOD)
+        while True:
+            if self.board.fused_frames >= fusion_settings.MIN_FRAMES or next_frame is None:
+                # A single frame is decoded from its own detections, the prior would only hide weak changes
+                if self.board.fused_frames == 1:
+                    pieces = pieces_points
+                else:
+                    pieces = self.board.belief_detections()
+                try:
+                    return self.decode_move(pieces)
+                except Exception as e:
+                    if next_frame is None or self.board.fused_frames >= fusion_settings.MAX_FRAMES:
+                        raise
+                    print(f'No move after fusing {self.board.fused_frames} frames ({e}), fusing another frame')
+
+            img = next_frame()
+            if img is None:
+                # Decoded from the frames fused so far
+                next_frame = None
+                continue
+            self.board.update_belief(self.detect_pieces(img), fusion_settings.EMPTY_LIKELIHOOD)
+
+    # Copy of the newest webcam frame, None if the camera delivers none
+    def grab_frame(self):
+        frame, age = self.webcam.read()
+        if frame is None:
+            print('No frame found')
+            return None
+        return frame.image.copy()
+
+    # Move identified from the per-square pixel difference alone, None if the detector is needed
+    def prefilter_move(self, img):
+        if self.board_diff is None or img is None:
+            return None
+        # Restored without a frame or a move was undone, this one becomes the reference once its move is decoded
+        if self.board_diff.reference is None:
+            self.board_diff.set_pending(img)
+            return None
+
+        candidates, unclear = self.board_diff.candidates(img)
+        print('Changed square candidates: ' + ', '.join(f'{coord} ({energy:.1f})' for coord, energy in candidates))
+        if len(unclear) > 0:
+            print('Unclear squares ' + ', '.join(unclear) + ', using the detector')
+            return None
+        return match_move([coord for coord, energy in candidates], self.game)
+
+    def apply_move(self, move):
+        update_squares = self.board.squares_for_move(move, self.game)
+        self.game.push(move)
+        self.board.update_board(update_squares)
+        self.prepare_move_table()
+        return move
+
+    # Pops the moves back to an earlier ply whose position the detections show, after players took moves back or
+    # an illegal move was corrected
+    def take_back(self, pieces_points):
+        plies = self.board.find_earlier_position(pieces_points, config.settings.TAKEBACK.MAX_PLIES)
+        if plies is None or plies > len(self.game.move_stack):
+            return False
+
+        self.board.rollback(plies)
+        moves = [self.game.pop() for i in range(plies)]
+        self.prepare_move_table()
+        print('Took back ' + ' '.join(move.uci() for move in reversed(moves)))
+        return True
+
+    # Takes back the last move, e.g. a misdetected one, by restoring the board from its history instead of
+    # detecting it again
+    def undo_move(self):
+        # Bound to a key, so it runs on the Tk thread while the pipeline may be decoding a move
+        with self.board_lock:
+            if len(self.game.move_stack) == 0 or not self.board.rollback():
+                print('No move to undo')
+                return None
+
+            move = self.game.pop()
+            self.prepare_move_table()
+            # The reference frame shows the undone move, the next tracked frame replaces it
+            if self.board_diff is not None:
+                self.board_diff.reset()
+        print('Undid move ' + move.uci())
+        return move
+
+    def track_move(self, img, next_frame=None):
+        start = round(time.time() * 1000)
+
+        move = self.prefilter_move(img)
+        if move is not None:
+            self.apply_move(move)
+            print('Move {} found from pixel difference in {} ms'.format(move.uci(), round(time.time() * 1000) - start))
+        else:
+            predictions = self.detect_pieces(img)
+            print('Predictions took {} ms'.format(round(time.time() * 1000) - start))
+
+            start1 = round(time.time() * 1000)
+            move = self.decode_fused(predictions, next_frame)
+            print('Move took {} ms'.format(round(time.time() * 1000) - start1))
+
+        if self.board_diff is not None:
+            self.board_diff.commit()
+
+        print('Full detection took {} ms'.format(round(time.time() * 1000) - start))
+        return move
+
+    def render_board(self, game=None):
+        if game is None:
+            game = self.game
+        lastmove = game.peek() if len(game.move_stack) > 0 else None
+        svg = chess.svg.board(game, lastmove=lastmove, size=600).encode()
+        png = cairosvg.svg2png(bytestring=svg)
+        return cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+
+    def process_move(self, frame=None):
         self.move_index += 1
-        img = self.webcam.read()
+        if frame is None:
+            frame, age = self.webcam.read()
+            if frame is not None:
+                print('Frame {} is {} ms old'.format(frame.seq, round(age * 1000)))
+            # Manually triggered move, the motion trigger should not report it again
+            if self.motion_trigger is not None:
+                self.motion_trigger.reset()
+        # The webcam buffer is only leased until the next read, which fusion (grab_frame) makes before the frame
+        # is drawn on and saved
+        img = frame.image.copy() if frame is not None else None
 
         if img is None:
             print('No frame found')
 
+        pieces_points = None
         if len(self.board_corners) == 0 or len(self.square_corners) == 0:
             start = round(time.time() * 1000)
-            self.initialize_board(img)
+            pieces_points = self.initialize_board(img)
             print('Initialization took {} ms'.format(round(time.time() * 1000) - start))
         else:
-            start = round(time.time() * 1000)
-
-            predictions = self.predictor.detect(img)
-            predictions = self.predictor.predictions_to_pieces_points(predictions)
-
-            print('Predictions took {} ms'.format(round(time.time() * 1000) - start))
-
-            start1 = round(time.time() * 1000)
-
-            changed_squares = self.board.get_changed_squares(predictions)
-            move_uci, update_squares = self.board.get_move(changed_squares, predictions, self.game.legal_moves)
-            move_uci = chess.Move.from_uci(move_uci)
-
-            print('Move took {} ms'.format(round(time.time() * 1000) - start1))
-
-            self.game.push(move_uci)
-            self.board.update_board(update_squares)
+            self.track_move(img, self.grab_frame)
 
-            print('Full detection took {} ms'.format(round(time.time() * 1000) - start))
             print(self.game.unicode(invert_color=True, borders=True))
             print(self.game.fen())
             print()
 
-            svg = chess.svg.board(self.game, lastmove=self.game.peek(), size=600).encode()
-            cairosvg.svg2png(svg, write_to='tmp/current_svg.png')
-            current_svg = cv2.imread('tmp/current_svg.png')
-
-            self.show_board(current_svg)
+            self.show_board(self.render_board())
 
-        self.draw_corners(img)
-        self.show_image(img)
+        self.show_image(self.annotate(img, pieces_points))
 
         self.save_game_move(img)
 
@@ -150,33 +720,17 @@ class ChessGameTracker:
         if img is None:
             print('No frame found')
 
+        pieces_points = None
         if len(self.board_corners) == 0 or len(self.square_corners) == 0:
             start = round(time.time() * 1000)
-            self.initialize_board(img)
+            pieces_points = self.initialize_board(img)
             print('Initialization took {} ms'.format(round(time.time() * 1000) - start))
         else:
-            start = round(time.time() * 1000)
-            predictions = self.predictor.detect(img)
-            predictions = self.predictor.predictions_to_pieces_points(predictions)
-            print('Predictions took {} ms'.format(round(time.time() * 1000) - start))
-
-            start1 = round(time.time() * 1000)
-            changed_squares = self.board.get_changed_squares(predictions)
-            move_uci, update_squares = self.board.get_move(changed_squares, predictions, self.game.legal_moves)
-            move_uci = chess.Move.from_uci(move_uci)
-            print('Move took {} ms'.format(round(time.time() * 1000) - start1))
-
-            self.game.push(move_uci)
-            self.board.update_board(update_squares)
-            print('Full detection took {} ms'.format(round(time.time() * 1000) - start))
+            self.track_move(img)
 
-            svg = chess.svg.board(self.game, lastmove=self.game.peek(), size=600).encode()
-            cairosvg.svg2png(svg, write_to='tmp/current_svg.png')
-            current_svg = cv2.imread('tmp/current_svg.png')
             print('\n')
-            self.show_board(current_svg)
+            self.show_board(self.render_board())
 
-        # self.draw_corners(img)
-        self.show_image(img)
+        self.show_image(self.annotate(img, pieces_points, corners=False))
 
         self.save_game_move(img)
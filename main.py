@@ -1,10 +1,28 @@
 import tkinter
+
+import config
 from gameTracker import ChessGameTracker
+from pipeline import MovePipeline
 
 
 def key_pressed(event, game_tracker):
     if event.char == 'a':  # Check if 'a' was pressed
-        game_tracker.process_move_mock()
+        if game_tracker.pipeline is not None:
+            game_tracker.pipeline.submit()
+        else:
+            game_tracker.process_move_mock()
+    if event.char == 'z':  # Take back a misdetected move
+        game_tracker.undo_move()
+
+
+def poll_motion(root, game_tracker):
+    game_tracker.poll_motion()
+    root.after(config.settings.MOTION_TRIGGER.POLL_INTERVAL_MS, lambda: poll_motion(root, game_tracker))
+
+
+def show_pipeline_results(root, game_tracker):
+    game_tracker.pipeline.show_results()
+    root.after(config.settings.PIPELINE.DISPLAY_INTERVAL_MS, lambda: show_pipeline_results(root, game_tracker))
 
 
 if __name__ == '__main__':
@@ -12,5 +30,18 @@ if __name__ == '__main__':
     root.geometry('1200x1200')
 
     gt = ChessGameTracker('games', root)
+    if config.settings.WARM_UP.ENABLED:
+        gt.warm_up()
+    if config.settings.STATE.RESTORE:
+        img = gt.grab_frame() if config.settings.STATE.VALIDATE else None
+        if config.settings.STATE.VALIDATE and img is None:
+            print('No frame to validate the saved board position against, starting a new game')
+        else:
+            gt.restore_state(img)
+    if config.settings.PIPELINE.ENABLED:
+        gt.pipeline = MovePipeline(gt, queue_size=config.settings.PIPELINE.QUEUE_SIZE)
+        show_pipeline_results(root, gt)
     root.bind('<KeyPress>', lambda e: key_pressed(event=e, game_tracker=gt))
+    if config.settings.MOTION_TRIGGER.ENABLED:
+        poll_motion(root, gt)
     root.mainloop()
@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+
+IDLE = 'idle'
+MOTION = 'motion'
+
+
+class MotionTrigger:
+    """Cheap frame differencing over the board region which decides when a move has been completed.
+
+    A move is reported once the sequence "motion starts -> scene is still for `still_frames` frames ->
+    board differs from the last still board" has been observed, so the expensive piece detection runs
+    only once per real move.
+    """
+
+    def __init__(self, board_corners, size=96, pixel_threshold=25, motion_threshold=2.0, still_threshold=0.3,
+                 change_threshold=1.0, still_frames=10):
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.motion_threshold = motion_threshold
+        self.still_threshold = still_threshold
+        self.change_threshold = change_threshold
+        self.still_frames = still_frames
+
+        destination = np.float32([[0, 0], [size, 0], [size, size], [0, size]])
+        self.transform = cv2.getPerspectiveTransform(np.float32(board_corners), destination)
+
+        self.state = IDLE
+        self.still_count = 0
+        self.reference = None
+        self.previous = None
+
+    def reset(self):
+        self.state = IDLE
+        self.still_count = 0
+        self.reference = None
+        self.previous = None
+
+    def _board_image(self, img):
+        board = cv2.warpPerspective(img, self.transform, (self.size, self.size), flags=cv2.INTER_AREA)
+        board = cv2.cvtColor(board, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(board, (5, 5), 0)
+
+    # Percentage of board pixels which differ noticeably between two board images
+    def _changed_percentage(self, board_a, board_b):
+        diff = cv2.absdiff(board_a, board_b)
+        return np.count_nonzero(diff > self.pixel_threshold) * 100.0 / diff.size
+
+    def update(self, img):
+        board = self._board_image(img)
+
+        if self.reference is None:
+            self.reference = board
+            self.previous = board
+            return False
+
+        motion = self._changed_percentage(board, self.previous)
+        self.previous = board
+
+        if self.state == IDLE:
+            if motion > self.motion_threshold:
+                self.state = MOTION
+                self.still_count = 0
+            return False
+
+        if motion > self.still_threshold:
+            self.still_count = 0
+            return False
+
+        self.still_count += 1
+        if self.still_count < self.still_frames:
+            return False
+
+        self.state = IDLE
+        # Hand went over the board, but nothing was moved
+        if self._changed_percentage(board, self.reference) < self.change_threshold:
+            return False
+
+        self.reference = board
+        return True
@@ -0,0 +1,167 @@
+import chess
+import chess.polyglot
+import numpy as np
+
+
+def piece_class(chess_piece):
+    """Belief class index (see `board.boardState.belief_classes`) of a python-chess piece, 0 for empty."""
+    if chess_piece is None:
+        return 0
+    # belief_classes lists the white pieces after empty in piece type order, then the black pieces
+    return chess_piece.piece_type + (0 if chess_piece.color == chess.WHITE else len(chess.PIECE_TYPES))
+
+
+def position_classes(game):
+    """Belief class of every square of `game`, in python-chess square order."""
+    classes = np.zeros(64, dtype=np.int64)
+    for square, chess_piece in game.piece_map().items():
+        classes[square] = piece_class(chess_piece)
+    return classes
+
+
+def move_changes(move, game):
+    """(square, new class) of every square whose content changes when `move` is played in `game`."""
+    moving = game.piece_at(move.from_square)
+    if move.promotion is not None:
+        moving = chess.Piece(move.promotion, moving.color)
+
+    if game.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        rook = chess.Piece(chess.ROOK, moving.color)
+        if chess.square_file(move.to_square) == 6:
+            return [(move.from_square, 0), (chess.square(7, rank), 0),
+                    (chess.square(6, rank), piece_class(moving)), (chess.square(5, rank), piece_class(rook))]
+        return [(move.from_square, 0), (chess.square(0, rank), 0),
+                (chess.square(2, rank), piece_class(moving)), (chess.square(3, rank), piece_class(rook))]
+
+    changes = [(move.from_square, 0), (move.to_square, piece_class(moving))]
+    if game.is_en_passant(move):
+        changes.append((chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square)), 0))
+    return changes
+
+
+def score_moves(log_likelihood, game, moves=None):
+    """Log-likelihood gain of every move over the current position.
+
+    `log_likelihood` is a 64x13 array of per-square observation log-likelihoods over the belief classes. A move
+    only changes the likelihood of the squares it changes, so all moves are scored with one gather and one
+    bincount over their changed squares. Returns the moves and their scores.
+    """
+    if moves is None:
+        moves = list(game.legal_moves)
+
+    current = position_classes(game)
+    move_indices, squares, classes = [], [], []
+    for i, move in enumerate(moves):
+        for square, new_class in move_changes(move, game):
+            move_indices.append(i)
+            squares.append(square)
+            classes.append(new_class)
+
+    squares = np.array(squares, dtype=np.int64)
+    gains = log_likelihood[squares, classes] - log_likelihood[squares, current[squares]]
+    return moves, np.bincount(move_indices, weights=gains, minlength=len(moves))
+
+
+def decode_legal_move(log_likelihood, game):
+    """Legal move best explaining the observations.
+
+    Returns the best move, its margin and the runner-up move. The margin is the log-likelihood difference to the
+    better of the runner-up and no move at all, so a small margin means the observations are ambiguous.
+    """
+    moves, scores = score_moves(log_likelihood, game)
+    if len(moves) == 0:
+        return None, 0.0, None
+
+    order = np.argsort(scores)[::-1]
+    best = moves[order[0]]
+    runner_up = moves[order[1]] if len(moves) > 1 else None
+    alternative = max(scores[order[1]] if len(moves) > 1 else -np.inf, 0.0)
+    return best, float(scores[order[0]] - alternative), runner_up
+
+
+def catch_up(log_likelihood, game, max_plies=3, beam_width=8, ply_penalty=2.0):
+    """Sequence of up to `max_plies` legal moves whose resulting position best explains the observations.
+
+    Beam search: every ply, the children of the `beam_width` best positions are scored with `score_moves` and
+    the best ones kept. Positions are tracked in a transposition table keyed by their Zobrist hash, so a
+    position reached by several move orders is expanded once. Every ply costs `ply_penalty`, so a shorter
+    sequence wins unless a longer one explains the observations clearly better.
+
+    Returns the moves and their log-likelihood gain over the current position, no moves if nothing beats it.
+    """
+    transpositions = {chess.polyglot.zobrist_hash(game)}
+    beam = [(0.0, [], game)]
+    best_gain, best_moves = 0.0, []
+
+    for ply in range(max_plies):
+        children = []
+        for gain, moves, position in beam:
+            legal_moves, scores = score_moves(log_likelihood, position)
+            for i in np.argsort(scores)[::-1][:beam_width]:
+                children.append((gain + scores[i] - ply_penalty, moves + [legal_moves[i]], position))
+
+        children.sort(key=lambda child: child[0], reverse=True)
+        beam = []
+        for gain, moves, parent in children:
+            position = parent.copy(stack=False)
+            position.push(moves[-1])
+            key = chess.polyglot.zobrist_hash(position)
+            if key in transpositions:
+                continue
+            transpositions.add(key)
+
+            beam.append((gain, moves, position))
+            if gain > best_gain:
+                best_gain, best_moves = gain, moves
+            if len(beam) == beam_width:
+                break
+
+    return best_moves, best_gain
+
+
+def change_signature(before, after):
+    """Squares which become occupied, become empty and change piece color between two positions, as bitboards.
+
+    The same signature is computed from detections by `Board.changed_bitboards`.
+    """
+    appeared = after.occupied & ~before.occupied
+    vanished = before.occupied & ~after.occupied
+    recolored = before.occupied & after.occupied & (
+        before.occupied_co[chess.WHITE] & after.occupied_co[chess.BLACK] |
+        before.occupied_co[chess.BLACK] & after.occupied_co[chess.WHITE]
+    )
+    return appeared, vanished, recolored
+
+
+class MoveTable:
+    """Legal moves of one position keyed by the change signature they produce.
+
+    Promotions to different pieces share a signature, so every signature maps to a list of moves. `key` is the
+    Zobrist hash of the position, to tell whether the table still belongs to the current game.
+    """
+
+    def __init__(self, game):
+        self.key = chess.polyglot.zobrist_hash(game)
+        self.moves = {}
+
+        after = game.copy(stack=False)
+        for move in game.legal_moves:
+            after.push(move)
+            self.moves.setdefault(change_signature(game, after), []).append(move)
+            after.pop()
+
+    def lookup(self, signature):
+        """Moves producing `signature`, or else the moves explaining all but one spurious change of it."""
+        if signature in self.moves:
+            return self.moves[signature]
+
+        observed = chess.popcount(signature[0] | signature[1] | signature[2])
+        repaired = []
+        for move_signature, moves in self.moves.items():
+            explained = all(move_mask & ~mask == 0 for move_mask, mask in zip(move_signature, signature))
+            if explained and observed - chess.popcount(move_signature[0] | move_signature[1] | move_signature[2]) == 1:
+                repaired.append(moves)
+
+        # Several ways to drop one change are as likely as none
+        return repaired[0] if len(repaired) == 1 else []
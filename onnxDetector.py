@@ -0,0 +1,162 @@
+import ast
+import os
+
+import cv2
+import numpy as np
+import onnxruntime
+
+from detections import Detections
+
+
+def letterbox(img, size, stretch=False, color=(114, 114, 114)):
+    height, width = img.shape[:2]
+
+    # RT-DETR is trained on images stretched to the input size instead of letterboxed ones
+    if stretch:
+        resized = cv2.resize(img, (size, size), interpolation=cv2.INTER_LINEAR)
+        return resized, (size / width, size / height), (0, 0)
+
+    scale = min(size / height, size / width)
+    new_width = int(round(width * scale))
+    new_height = int(round(height * scale))
+    resized = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    left = (size - new_width) // 2
+    top = (size - new_height) // 2
+    padded = cv2.copyMakeBorder(resized, top, size - new_height - top, left, size - new_width - left,
+                                cv2.BORDER_CONSTANT, value=color)
+    return padded, (scale, scale), (left, top)
+
+
+def non_max_suppression(boxes, scores, classes, iou_threshold):
+    # Offset boxes by class, so that boxes of different classes never overlap
+    offset_boxes = boxes + (classes * (boxes.max() + 1))[:, None]
+    x0, y0, x1, y1 = offset_boxes.T
+    areas = (x1 - x0) * (y1 - y0)
+
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        width = np.clip(np.minimum(x1[i], x1[rest]) - np.maximum(x0[i], x0[rest]), 0, None)
+        height = np.clip(np.minimum(y1[i], y1[rest]) - np.maximum(y0[i], y0[rest]), 0, None)
+        intersection = width * height
+        iou = intersection / (areas[i] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+
+    return np.array(keep, dtype=int)
+
+
+def _cxcywh_to_xyxy(boxes):
+    cx, cy, w, h = boxes.T
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+class OnnxDetector:
+    """Piece detector running an exported RT-DETR or YOLO graph with ONNX Runtime on the CPU.
+
+    Pre- and postprocessing are done in numpy and the boxes are returned as `Detections`.
+    """
+
+    def __init__(self, model_path, architecture, class_names=None, conf=0.1, iou=0.45, intra_op_threads=0,
+                 inter_op_threads=1):
+        if architecture not in ('rtdetr', 'yolo'):
+            raise ValueError(f'Unknown architecture: {architecture}')
+
+        self.architecture = architecture
+        self.conf = conf
+        self.iou = iou
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads or os.cpu_count()
+        options.inter_op_num_threads = inter_op_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.dynamic_size = not isinstance(model_input.shape[2], int)
+        self.input_size = 640 if self.dynamic_size else model_input.shape[2]
+        self.fixed_batch = isinstance(model_input.shape[0], int)
+
+        if class_names is None:
+            metadata = self.session.get_modelmeta().custom_metadata_map
+            if 'names' not in metadata:
+                raise ValueError(f'{model_path} has no class names in its metadata, set PREDICTOR.ONNX.CLASS_NAMES')
+            class_names = ast.literal_eval(metadata['names'])
+        if isinstance(class_names, dict):
+            class_names = [class_names[i] for i in sorted(class_names)]
+        self.names = list(class_names)
+
+    def _preprocess(self, img, input_size=None):
+        # Graphs exported with a static input shape always run at their export size
+        if input_size is None or not self.dynamic_size:
+            input_size = self.input_size
+        image, scale, pad = letterbox(img, input_size, stretch=self.architecture == 'rtdetr')
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = image.transpose(2, 0, 1).astype(np.float32) / 255.0
+        return image, scale, pad
+
+    def _postprocess_rtdetr(self, output, img_shape):
+        height, width = img_shape[:2]
+        scores = output[:, 4:]
+        classes = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+        keep = confidences > self.conf
+
+        boxes = _cxcywh_to_xyxy(output[keep, :4]) * np.array([width, height, width, height])
+        return boxes, confidences[keep], classes[keep]
+
+    def _postprocess_yolo(self, output, img_shape, scale, pad):
+        # YOLOv8 style exports are channel first and have no objectness score
+        if output.shape[0] == 4 + len(self.names):
+            output = output.T
+            scores = output[:, 4:]
+        else:
+            scores = output[:, 5:] * output[:, 4:5]
+
+        classes = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+        keep = confidences > self.conf
+        boxes = _cxcywh_to_xyxy(output[keep, :4])
+        confidences = confidences[keep]
+        classes = classes[keep]
+
+        if len(boxes) > 0:
+            keep = non_max_suppression(boxes, confidences, classes, self.iou)
+            boxes, confidences, classes = boxes[keep], confidences[keep], classes[keep]
+
+        boxes = (boxes - np.array([pad[0], pad[1], pad[0], pad[1]])) / np.array([scale[0], scale[1]] * 2)
+        height, width = img_shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        return boxes, confidences, classes
+
+    def _postprocess(self, output, img_shape, scale, pad):
+        if self.architecture == 'rtdetr':
+            boxes, confidences, classes = self._postprocess_rtdetr(output, img_shape)
+        else:
+            boxes, confidences, classes = self._postprocess_yolo(output, img_shape, scale, pad)
+        return Detections.from_boxes(boxes, classes, confidences, self.names)
+
+    def detect(self, img, input_size=None):
+        return self.detect_batch([img], input_size)[0]
+
+    def detect_batch(self, images, input_size=None):
+        inputs = [self._preprocess(img, input_size) for img in images]
+
+        # Graphs exported with a static batch dimension have to be run one image at a time
+        if self.fixed_batch:
+            outputs = [self.session.run(None, {self.input_name: image[None]})[0][0] for image, _, _ in inputs]
+        else:
+            batch = np.stack([image for image, _, _ in inputs])
+            outputs = self.session.run(None, {self.input_name: batch})[0]
+
+        return [
+            self._postprocess(output, img.shape, scale, pad)
+            for output, img, (_, scale, pad) in zip(outputs, images, inputs)
+        ]
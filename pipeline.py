@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Empty, Queue
+
+
+class MovePipeline:
+    """Runs move processing of a `ChessGameTracker` as concurrent stages.
+
+    capture -> detect (one worker thread) -> decode (one thread, in submission order) -> render and save (one
+    worker thread, in move order). Detection of the next frame runs while the previous move is decoded, and
+    rendering and disk writes never block detection. The detector model is only ever used from the detection
+    thread, which also initializes the board. Decoding holds `tracker.board_lock` while it changes the board and
+    game, and detection reads them through `tracker.snapshot_state`. Results for the Tk window are queued and
+    displayed by `show_results`, which has to be called from the Tk thread.
+    """
+
+    def __init__(self, tracker, queue_size=2):
+        self.tracker = tracker
+        self.detector = ThreadPoolExecutor(max_workers=1, thread_name_prefix='move-detect')
+        self.saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix='move-save')
+        # Bounded, so frames are dropped instead of piling up when detection falls behind
+        self.decode_queue = Queue(maxsize=queue_size)
+        self.display_queue = Queue()
+
+        self.decoder = threading.Thread(target=self._decode_worker)
+        self.decoder.daemon = True
+        self.decoder.start()
+
+    def submit(self, frame=None):
+        """Queue a frame for move processing and return a future resolving to the decoded `chess.Move`.
+
+        Without a frame, the newest webcam frame is captured. The future resolves to None for the frame
+        used to initialize the board and for frames showing taken back moves. It is cancelled if the frame
+        is dropped because decoding is behind, so the Tk thread never blocks here.
+        """
+        move_future = Future()
+        if frame is None:
+            frame, age = self.tracker.webcam.read()
+        if frame is None:
+            print('No frame found')
+            move_future.cancel()
+            return move_future
+
+        # Only this thread adds to the queue, so it cannot fill up between the check and put_nowait
+        if self.decode_queue.full():
+            print('Decoding is behind, dropping frame')
+            move_future.cancel()
+            return move_future
+
+        # Webcam buffers are reused by the capture thread, the stages need their own copy
+        img = frame.image.copy()
+        self.tracker.move_index += 1
+        detect_future = self.detector.submit(self._detect, img)
+        self.decode_queue.put_nowait((self.tracker.move_index, img, detect_future, move_future))
+        return move_future
+
+    async def submit_async(self, frame=None):
+        return await asyncio.wrap_future(self.submit(frame))
+
+    # Frames queued before the board is initialized are detected again once it is
+    def _detect(self, img):
+        if self.tracker.board is None:
+            return None
+        return self.tracker.detect_pieces(img)
+
+    def _decode_worker(self):
+        while True:
+            item = self.decode_queue.get()
+            if item is None:
+                break
+
+            move_index, img, detect_future, move_future = item
+            if not move_future.set_running_or_notify_cancel():
+                detect_future.cancel()
+                continue
+
+            start = time.perf_counter()
+            initial_points = None
+            try:
+                # Decided here rather than in submit, so frames queued during initialization are decoded as moves
+                if self.tracker.board is None:
+                    detect_future.cancel()
+                    initial_points = self.detector.submit(self.tracker.initialize_board, img).result()
+                    move = None
+                else:
+                    with self.tracker.board_lock:
+                        move = self.tracker.prefilter_move(img)
+                        if move is not None:
+                            detect_future.cancel()
+                            self.tracker.apply_move(move)
+
+                    if move is None:
+                        # Waited for outside the lock, detection takes its state snapshot under it
+                        pieces_points = detect_future.result()
+                        if pieces_points is None:
+                            pieces_points = self.detector.submit(self.tracker.detect_pieces, img).result()
+                        with self.tracker.board_lock:
+                            move = self.tracker.decode_fused(pieces_points)
+
+                    if self.tracker.board_diff is not None:
+                        self.tracker.board_diff.commit()
+                with self.tracker.board_lock:
+                    game = self.tracker.game.copy()
+            except Exception as e:
+                print(f'Move {move_index} failed: {e}')
+                move_future.set_exception(e)
+                continue
+
+            print('Move {} decoded in {} ms'.format(move_index, round((time.perf_counter() - start) * 1000)))
+            move_future.set_result(move)
+            # A single thread, so frames and state are saved in move order
+            self.saver.submit(self._render_and_save, img, move_index, game, initial_points)
+
+    def _render_and_save(self, img, move_index, game, initial_points=None):
+        board_image = self.tracker.render_board(game) if len(game.move_stack) > 0 else None
+        display = self.tracker.annotate(img, initial_points, corners=False) if initial_points is not None else img
+        self.display_queue.put((display, board_image))
+        self.tracker.save_game_move(img, move_index, game)
+
+    def show_results(self):
+        while True:
+            try:
+                img, board_image = self.display_queue.get_nowait()
+            except Empty:
+                return
+
+            if board_image is not None:
+                self.tracker.show_board(board_image)
+            self.tracker.show_image(img)
+
+    def close(self):
+        self.decode_queue.put(None)
+        self.decoder.join()
+        self.detector.shutdown(wait=True)
+        self.saver.shutdown(wait=True)
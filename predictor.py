@@ -1,128 +1,125 @@
 import cv2
+import numpy as np
 import torch
 
 from ultralytics import RTDETR
 
-
-class Prediction:
-    point = []
-    name = ''
-    conf = 0
-
-    def __init__(self, point, name, conf):
-        self.point = point
-        self.name = name
-        self.conf = conf
-
-
-def bounding_box_bottom_middle(point_left, point_right):
-    x_left = point_left[0]
-    y_left = point_left[1]
-    x_right = point_right[0]
-    y_right = point_right[1]
-    height = y_left - y_right
-    return [int((x_left + x_right) * 0.5), y_right + int(height * 0.15)]
-
-
-def _predictions_to_pieces_points_yolo(predictions):
-    results = []
-
+from detections import Detections
+from onnxDetector import OnnxDetector, non_max_suppression
+
+# Exported graphs run with ONNX Runtime: model type -> (architecture, model path)
+# yolov7 graphs have to be exported with `--grid` and without `--end2end`, so they output decoded boxes
+ONNX_MODELS = {
+    'rtdetr-onnx': ('rtdetr', 'models/rt-detr-best.onnx'),
+    'yolo-onnx': ('yolo', 'models/yolov7_last.onnx'),
+    # INT8 variants, created with `python quantization.py quantize`
+    'rtdetr-onnx-int8': ('rtdetr', 'models/rt-detr-best.int8.onnx'),
+    'yolo-onnx-int8': ('yolo', 'models/yolov7_last.int8.onnx'),
+}
+
+
+# Class names of the yolov7 checkpoint, in the order of its outputs. yolov7's export.py writes no names into the
+# ONNX graph, unlike Ultralytics exports
+def yolov7_class_names(model_path='models/yolov7_last.pt'):
+    model = torch.hub.load("WongKinYiu/yolov7", "custom", f"{model_path}", trust_repo=True)
+    return list(model.names)
+
+
+# Bounding rectangle of the board quadrilateral, padded so that tall pieces on the far rank are not cut off
+def board_roi(img_shape, board_corners, padding=0.15):
+    corners = np.array(board_corners)
+    x_min, y_min = corners.min(axis=0)
+    x_max, y_max = corners.max(axis=0)
+    pad_x = (x_max - x_min) * padding
+    pad_y = (y_max - y_min) * padding
+
+    x0 = max(0, int(x_min - pad_x))
+    y0 = max(0, int(y_min - 2 * pad_y))
+    x1 = min(img_shape[1], int(x_max + pad_x))
+    y1 = min(img_shape[0], int(y_max + pad_y))
+    return x0, y0, x1, y1
+
+
+# Detector input size at which an average board square spans about `target_square_size` pixels
+def inference_size(square_corners, crop_shape, target_square_size=32, min_size=320, max_size=1280, stride=32):
+    corners = np.array(square_corners, dtype=np.float64).reshape(9, 9, 2)
+    horizontal = np.linalg.norm(np.diff(corners, axis=0), axis=2).mean()
+    vertical = np.linalg.norm(np.diff(corners, axis=1), axis=2).mean()
+    square_size = (horizontal + vertical) / 2
+
+    size = max(crop_shape[:2]) * target_square_size / square_size
+    return int(np.clip(round(size / stride) * stride, min_size, max_size))
+
+
+# Overlapping tiles covering the region (x0, y0, x1, y1), as (x0, y0, x1, y1) tuples
+def tile_regions(region, rows=2, cols=2, overlap=0.25):
+    x0, y0, x1, y1 = region
+    tile_width = (x1 - x0) / (cols - (cols - 1) * overlap)
+    tile_height = (y1 - y0) / (rows - (rows - 1) * overlap)
+
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            tile_x = x0 + col * tile_width * (1 - overlap)
+            tile_y = y0 + row * tile_height * (1 - overlap)
+            tiles.append((int(tile_x), int(tile_y), int(round(tile_x + tile_width)), int(round(tile_y + tile_height))))
+    return tiles
+
+
+# Boxes touching a tile border which lies inside the region are cut off, the neighbouring tile sees them whole
+def _drop_cut_boxes(detections, tile, region, margin=2):
+    x0, y0, x1, y1 = detections.xyxy.T
+    cut = np.zeros(len(detections), dtype=bool)
+    if tile[0] > region[0]:
+        cut |= x0 <= tile[0] + margin
+    if tile[1] > region[1]:
+        cut |= y0 <= tile[1] + margin
+    if tile[2] < region[2]:
+        cut |= x1 >= tile[2] - margin
+    if tile[3] < region[3]:
+        cut |= y1 >= tile[3] - margin
+    return detections[~cut]
+
+
+def _shift_yolo(predictions, x, y):
     for prediction in predictions:
-        x = prediction['xmin']
-        y = prediction['ymin']
-        x1 = prediction['xmax']
-        y1 = prediction['ymax']
-        name = prediction['name']
-        x = int(x)
-        y = int(y)
-        x1 = int(x1)
-        y1 = int(y1)
-
-        midpoint = bounding_box_bottom_middle([x, y], [x1, y1])
-        results.append(Prediction(midpoint, name, prediction['confidence']))
-
-    return results
-
-
-def _find_closest_yolo(results):
-    highest_x = results[0]['xmax'] * results[0]['ymax']
-    rightmost_box = None
-    lowest_x = results[0]['xmin'] * (1 / results[0]['ymin'])
-    leftmost_box = None
-
-    for box in results:
-        current_x_min = box['xmin']
-        current_x_max = box['xmax']
-        current_y_min = box['ymin']
-        current_y_max = box['ymax']
-
-        prod_min = current_x_min * (1 / current_y_min)
-        prod_max = current_x_max * current_y_max
-        if prod_max >= highest_x:
-            highest_x = prod_max
-            rightmost_box = box
-
-        if prod_min <= lowest_x:
-            lowest_x = prod_min
-            leftmost_box = box
-
-    return (
-        leftmost_box,
-        rightmost_box,
-        leftmost_box['name'],
-        rightmost_box['name']
-    )
-
-
-def _find_closest_rtdetr(results):
-    boxes = results[0].boxes
-    highest_x = boxes[0].xyxy[0][2].item() * boxes[0].xyxy[0][3].item()
-    rightmost_box = None
-    lowest_x = boxes[0].xyxy[0][0].item() * (1 / boxes[0].xyxy[0][1].item())
-    leftmost_box = None
-
-    for box in boxes:
-        current_x_min = box.xyxy[0][0].item()
-        current_x_max = box.xyxy[0][2].item()
-        current_y_min = box.xyxy[0][1].item()
-        current_y_max = box.xyxy[0][3].item()
-        prod_min = current_x_min * (1 / current_y_min)
-        prod_max = current_x_max * current_y_max
-
-        if prod_max >= highest_x:
-            highest_x = prod_max
-            rightmost_box = box
-
-        if prod_min <= lowest_x:
-            lowest_x = prod_min
-            leftmost_box = box
-
-    return (
-        leftmost_box,
-        rightmost_box,
-        results[0].names[leftmost_box.cls[0].item()],
-        results[0].names[rightmost_box.cls[0].item()]
-    )
-
-def _find_closest_rtdetr_points(pieces_points):
-    highest_x = pieces_points[0].point[0] * pieces_points[0].point[1]
-    rightmost_box = None
-    lowest_x = pieces_points[0].point[0] * (1 / pieces_points[0].point[1])
-    leftmost_box = None
-
-    for piece_point in pieces_points:
-        current_x = piece_point.point[0]
-        current_y = piece_point.point[1]
-        prod_min = current_x * (1 / current_y)
-        prod_max = current_x * current_y
-
-        if prod_max >= highest_x:
-            highest_x = prod_max
-            rightmost_box = piece_point
-
-        if prod_min <= lowest_x:
-            lowest_x = prod_min
-            leftmost_box = piece_point
+        prediction['xmin'] += x
+        prediction['xmax'] += x
+        prediction['ymin'] += y
+        prediction['ymax'] += y
+    return predictions
+
+
+def _shift_rtdetr(predictions, img, x, y):
+    for result in predictions:
+        data = result.boxes.data.clone()
+        data[:, [0, 2]] += x
+        data[:, [1, 3]] += y
+        result.orig_img = img
+        result.orig_shape = img.shape[:2]
+        result.update(boxes=data)
+    return predictions
+
+
+def _predictions_to_pieces_points_yolo(predictions, names):
+    xyxy = [[p['xmin'], p['ymin'], p['xmax'], p['ymax']] for p in predictions]
+    classes = [p['class'] for p in predictions]
+    confidences = [p['confidence'] for p in predictions]
+    return Detections.from_boxes(xyxy, classes, confidences, names)
+
+
+# Leftmost and rightmost pieces as seen from the camera, used to determine the board orientation
+def _find_closest_points(pieces_points):
+    x = pieces_points.x.astype(np.float64)
+    y = pieces_points.y.astype(np.float64)
+    prod_min = x * (1 / y)
+    prod_max = x * y
+
+    # Last occurrence wins on ties
+    leftmost_index = len(prod_min) - 1 - np.argmin(prod_min[::-1])
+    rightmost_index = len(prod_max) - 1 - np.argmax(prod_max[::-1])
+    leftmost_box = pieces_points[leftmost_index]
+    rightmost_box = pieces_points[rightmost_index]
 
     return (
         leftmost_box,
@@ -131,30 +128,24 @@ def _find_closest_rtdetr_points(pieces_points):
         rightmost_box.name
     )
 
-def _predictions_to_pieces_points_rtdetr(predictions):
-    boxes = predictions[0].boxes
-    names = predictions[0].names
-    results = []
 
-    for box in boxes:
-        x, y, w, h = box.xyxy[0]
-        name = names[box.cls[0].item()]
-        x = int(x.item())
-        y = int(y.item())
-        x1 = int(w.item())
-        y1 = int(h.item())
+def _predictions_to_pieces_points_rtdetr(predictions):
+    return _result_to_pieces_points_rtdetr(predictions[0])
 
-        midpoint = bounding_box_bottom_middle([x, y], [x1, y1])
-        results.append(Prediction(midpoint, name, box.conf[0].item()))
 
-    return results
+def _result_to_pieces_points_rtdetr(result):
+    names = [result.names[i] for i in sorted(result.names)]
+    # xyxy, conf, cls per row, moved to numpy in a single transfer
+    data = result.boxes.data.cpu().numpy()
+    return Detections.from_boxes(data[:, :4], data[:, 5], data[:, 4], names)
 
 
 class Predictor:
     model = None
 
-    def __init__(self, model_type):
+    def __init__(self, model_type, roi_padding=0.15, intra_op_threads=0, inter_op_threads=1, class_names=None):
         self.model_type = model_type
+        self.roi_padding = roi_padding
 
         if model_type == 'yolo':
             yolov7_model_path = 'models/yolov7_last.pt'
@@ -167,32 +158,154 @@ class Predictor:
         if model_type == 'rtdetr':
             self.model = RTDETR('models/rt-detr-best.pt')
 
-    def detect(self, img, savedir=''):
+        if model_type in ONNX_MODELS:
+            architecture, model_path = ONNX_MODELS[model_type]
+            # RT-DETR graphs carry their class names in the model metadata
+            if not class_names and architecture == 'yolo':
+                class_names = yolov7_class_names()
+            self.model = OnnxDetector(model_path, architecture, class_names=class_names or None,
+                                      intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+
+    def detect(self, img, savedir='', roi=None, imgsz=None):
+        if roi is None:
+            return self._detect(img, savedir, imgsz)
+
+        x0, y0, x1, y1 = board_roi(img.shape, roi, self.roi_padding)
+        predictions = self._detect(img[y0:y1, x0:x1], savedir, imgsz)
+
+        if self.model_type == 'yolo':
+            return _shift_yolo(predictions, x0, y0)
+        if self.model_type == 'rtdetr':
+            return _shift_rtdetr(predictions, img, x0, y0)
+        if self.model_type in ONNX_MODELS:
+            return predictions.shifted(x0, y0)
+
+    def _model_kwargs(self, imgsz):
+        if imgsz is None:
+            return {}
+        if self.model_type == 'yolo':
+            return {'size': imgsz}
+        if self.model_type == 'rtdetr':
+            return {'imgsz': imgsz}
+        return {'input_size': imgsz}
+
+    def _detect(self, img, savedir='', imgsz=None):
         if self.model_type == 'yolo':
             img1 = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            results = self.model(img1)
+            results = self.model(img1, **self._model_kwargs(imgsz))
             formatted = results.pandas().xyxy[0].to_dict(orient="records")
             results.save('tmp/' + savedir)
             return formatted
 
         if self.model_type == 'rtdetr':
             print(self.model.device)
-            return self.model(img, iou=0.1, conf=0.1, line_width=1)
-
-    def find_closest_pieces(self, results):
+            return self.model(img, iou=0.1, conf=0.1, line_width=1, **self._model_kwargs(imgsz))
+
+        if self.model_type in ONNX_MODELS:
+            return self.model.detect(img, **self._model_kwargs(imgsz))
+
+    # Runs a single forward pass over all frames, returns pieces points for every frame
+    def detect_batch(self, frames, rois=None, imgsz=None):
+        if rois is None:
+            rois = [None] * len(frames)
+
+        crops = []
+        offsets = []
+        for img, roi in zip(frames, rois):
+            if roi is None:
+                crops.append(img)
+                offsets.append((0, 0))
+            else:
+                x0, y0, x1, y1 = board_roi(img.shape, roi, self.roi_padding)
+                crops.append(img[y0:y1, x0:x1])
+                offsets.append((x0, y0))
+
+        return self._detect_crops(crops, offsets, imgsz)
+
+    def detect_tiled(self, img, roi=None, rows=2, cols=2, overlap=0.25, iou=0.5, imgsz=None):
+        """Detect pieces on overlapping tiles of the board region, run as one batch.
+
+        Small pieces keep more pixels than when the whole frame is downscaled to the detector input size. Boxes cut
+        off at a tile seam are dropped and duplicates from the overlaps are merged with class-aware NMS.
+        """
+        if roi is None:
+            region = (0, 0, img.shape[1], img.shape[0])
+        else:
+            region = board_roi(img.shape, roi, self.roi_padding)
+
+        tiles = tile_regions(region, rows, cols, overlap)
+        crops = [img[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+        tile_detections = self._detect_crops(crops, [(x0, y0) for x0, y0, x1, y1 in tiles], imgsz)
+
+        names = tile_detections[0].names
+        detections = Detections.concatenate(
+            [_drop_cut_boxes(detections, tile, region) for detections, tile in zip(tile_detections, tiles)], names
+        )
+        if len(detections) == 0:
+            return detections
+        return detections[non_max_suppression(detections.xyxy, detections.conf, detections.cls, iou)]
+
+    def _detect_crops(self, crops, offsets, imgsz=None):
         if self.model_type == 'yolo':
-            return _find_closest_yolo(results)
+            results = self.model([cv2.cvtColor(crop, cv2.COLOR_BGR2RGB) for crop in crops], **self._model_kwargs(imgsz))
+            return [
+                _predictions_to_pieces_points_yolo(predictions.to_dict(orient="records"), self.model.names)
+                .shifted(x, y)
+                for predictions, (x, y) in zip(results.pandas().xyxy, offsets)
+            ]
+
         if self.model_type == 'rtdetr':
-            return _find_closest_rtdetr_points(results)
+            results = self.model(crops, iou=0.1, conf=0.1, line_width=1, **self._model_kwargs(imgsz))
+            return [
+                _result_to_pieces_points_rtdetr(result).shifted(x, y)
+                for result, (x, y) in zip(results, offsets)
+            ]
+
+        if self.model_type in ONNX_MODELS:
+            results = self.model.detect_batch(crops, **self._model_kwargs(imgsz))
+            return [detections.shifted(x, y) for detections, (x, y) in zip(results, offsets)]
+
+    def find_closest_pieces(self, results):
+        return _find_closest_points(results)
 
     def predictions_to_pieces_points(self, results):
         if self.model_type == 'yolo':
-            return _predictions_to_pieces_points_yolo(results)
+            return _predictions_to_pieces_points_yolo(results, self.model.names)
         if self.model_type == 'rtdetr':
             return _predictions_to_pieces_points_rtdetr(results)
+        if self.model_type in ONNX_MODELS:
+            return results
+
+
+class CascadePredictor:
+    """Runs a fast predictor first and escalates to a slower, more accurate one only for uncertain frames.
+
+    `accept` decides whether the fast detections are good enough. The share of escalated frames is kept in
+    `escalation_rate`.
+    """
+
+    def __init__(self, fast, accurate):
+        self.fast = fast
+        self.accurate = accurate
+        self.frames = 0
+        self.escalations = 0
+
+    @property
+    def escalation_rate(self):
+        return self.escalations / self.frames if self.frames > 0 else 0.0
+
+    def detect_pieces(self, img, accept, roi=None, imgsz=None):
+        self.frames += 1
+        detections = self.fast.predictions_to_pieces_points(self.fast.detect(img, roi=roi, imgsz=imgsz))
+        if accept(detections):
+            return detections
+
+        self.escalations += 1
+        print('Escalating to {}, escalation rate {:.0%}'.format(self.accurate.model_type, self.escalation_rate))
+        return self.accurate.predictions_to_pieces_points(self.accurate.detect(img, roi=roi, imgsz=imgsz))
 
 
 if __name__ == '__main__':
     predictor = Predictor('rtdetr')
 
-    predictor.detect(cv2.imread('tmp/testnow.jpeg'))
\ No newline at end of file
+    predictor.detect(cv2.imread('tmp/testnow.jpeg'))
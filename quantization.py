@@ -0,0 +1,155 @@
+import argparse
+import glob
+import random
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+from onnxDetector import OnnxDetector
+from predictor import ONNX_MODELS, Predictor
+
+# fp32 model type -> int8 model type
+QUANTIZED_MODELS = {
+    'rtdetr-onnx': 'rtdetr-onnx-int8',
+    'yolo-onnx': 'yolo-onnx-int8',
+}
+
+
+def calibration_image_paths(directories=('mock', 'games'), limit=200):
+    paths = []
+    for directory in directories:
+        paths += glob.glob(f'{directory}/*.jpg') + glob.glob(f'{directory}/*/*.jpg')
+
+    paths = sorted(paths)
+    if len(paths) > limit:
+        paths = random.Random(0).sample(paths, limit)
+    return paths
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+
+    def __init__(self, detector, image_paths):
+        self.detector = detector
+        self.image_paths = iter(image_paths)
+
+    def get_next(self):
+        for path in self.image_paths:
+            img = cv2.imread(path)
+            if img is None:
+                continue
+            image, _, _ = self.detector._preprocess(img)
+            return {self.detector.input_name: image[None]}
+        return None
+
+
+def quantize(model_type, method='static', image_paths=None):
+    architecture, model_path = ONNX_MODELS[model_type]
+    _, output_path = ONNX_MODELS[QUANTIZED_MODELS[model_type]]
+
+    if method == 'dynamic':
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+    else:
+        if image_paths is None:
+            image_paths = calibration_image_paths()
+        print(f'Calibrating on {len(image_paths)} images')
+        # Only preprocessing is needed for calibration, the class names do not matter
+        reader = ImageCalibrationReader(OnnxDetector(model_path, architecture, class_names=['piece']), image_paths)
+        quantize_static(model_path, output_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+    print(f'Saved quantized model to {output_path}')
+    return output_path
+
+
+def _iou(box, boxes):
+    width = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    height = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    intersection = width * height
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / ((box[2] - box[0]) * (box[3] - box[1]) + areas - intersection + 1e-9)
+
+
+# Greedily matches detections of the same class, returns per class (reference count, other count, matched count)
+def _match_detections(reference, other, iou_threshold):
+    reference_names = reference.class_names()
+    other_names = other.class_names()
+    counts = {}
+
+    for name in set(reference_names) | set(other_names):
+        reference_boxes = reference[reference_names == name]
+        other_boxes = other[other_names == name]
+        unmatched = np.ones(len(other_boxes), dtype=bool)
+        matched = 0
+
+        for i in np.argsort(-reference_boxes.conf):
+            if not unmatched.any():
+                break
+            ious = np.where(unmatched, _iou(reference_boxes.xyxy[i], other_boxes.xyxy), 0)
+            best = ious.argmax()
+            if ious[best] >= iou_threshold:
+                unmatched[best] = False
+                matched += 1
+
+        counts[name] = [len(reference_boxes), len(other_boxes), matched]
+
+    return counts
+
+
+def compare(model_type, image_paths, iou_threshold=0.5):
+    fp32 = Predictor(model_type)
+    int8 = Predictor(QUANTIZED_MODELS[model_type])
+
+    latencies = {'fp32': [], 'int8': []}
+    totals = defaultdict(lambda: [0, 0, 0])
+
+    for path in image_paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+
+        start = time.perf_counter()
+        reference = fp32.detect(img)
+        latencies['fp32'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        quantized = int8.detect(img)
+        latencies['int8'].append(time.perf_counter() - start)
+
+        for name, counts in _match_detections(reference, quantized, iou_threshold).items():
+            for i in range(3):
+                totals[name][i] += counts[i]
+
+    print(f'Compared {len(latencies["fp32"])} frames')
+    print(f'{"class":<16}{"fp32":>8}{"int8":>8}{"matched":>10}{"agreement":>12}')
+    for name in sorted(totals):
+        reference_count, quantized_count, matched = totals[name]
+        agreement = matched / max(1, reference_count + quantized_count - matched)
+        print(f'{name:<16}{reference_count:>8}{quantized_count:>8}{matched:>10}{agreement:>12.2%}')
+
+    fp32_latency = np.mean(latencies['fp32']) * 1000
+    int8_latency = np.mean(latencies['int8']) * 1000
+    print(f'Mean latency fp32: {fp32_latency:.1f} ms, int8: {int8_latency:.1f} ms, '
+          f'speedup: {fp32_latency / int8_latency:.2f}x')
+
+    return totals, latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantize the piece detector to INT8 and compare it to fp32.')
+    parser.add_argument('command', choices=['quantize', 'compare'])
+    parser.add_argument('--model', choices=list(QUANTIZED_MODELS), default='rtdetr-onnx')
+    parser.add_argument('--method', choices=['static', 'dynamic'], default='static',
+                        help='static quantization calibrates activations on the project images')
+    parser.add_argument('--images', nargs='+', default=['mock', 'games'],
+                        help='directories with calibration/comparison images')
+    parser.add_argument('--limit', type=int, default=200)
+    args = parser.parse_args()
+
+    paths = calibration_image_paths(args.images, args.limit)
+    if args.command == 'quantize':
+        quantize(args.model, args.method, paths)
+    else:
+        compare(args.model, paths)
@@ -0,0 +1,118 @@
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import chess.pgn
+import cv2
+import torch
+
+import config
+from gameTracker import ChessGameTracker
+
+
+def frame_paths(game_directory):
+    """Frames saved by `ChessGameTracker.save_game_move`, ordered by move index. The first one initialized the board."""
+    paths = [path for path in glob.glob(f'{game_directory}/*.jpg') if os.path.basename(path)[:-4].isdigit()]
+    return sorted(paths, key=lambda path: int(os.path.basename(path)[:-4]))
+
+
+def detect_frames(tracker, paths, batch_size):
+    # Only the detections are kept, so a long game never has all of its frames in memory
+    detections = []
+    for start in range(0, len(paths), batch_size):
+        images = [cv2.imread(path) for path in paths[start:start + batch_size]]
+        # Square crops depend only on the board geometry, full frame detection runs as one batch
+        if config.settings.SQUARE_CLASSIFIER.ENABLED:
+            detections += [tracker.square_classifier.detect(img, tracker.board) for img in images]
+        else:
+            roi = tracker.detection_roi()
+            rois = [roi] * len(images) if roi is not None else None
+            detections += tracker.predictor.detect_batch(images, rois=rois, imgsz=tracker.inference_size)
+    return detections
+
+
+def reconstruct(game_directory, batch_size=8, on_frame=None):
+    """Rebuild the game of a saved game directory.
+
+    Localizes the board once on the first frame, detects the pieces of all other frames in batches and decodes
+    the moves in order. Returns the PGN, the FEN of every ply (starting position first) and the frames whose
+    move could not be decoded.
+
+    `on_frame(path, tracker)` is called for the first frame and after every decoded frame, while `tracker.game`
+    is the position shown on that frame.
+    """
+    paths = frame_paths(game_directory)
+    if len(paths) == 0:
+        raise ValueError(f'No frames in {game_directory}')
+
+    tracker = ChessGameTracker(game_directory, None)
+    tracker.game = chess.Board()
+    tracker.initialize_board(cv2.imread(paths[0]))
+    if on_frame is not None:
+        on_frame(paths[0], tracker)
+
+    failed = []
+    for path, pieces_points in zip(paths[1:], detect_frames(tracker, paths[1:], batch_size)):
+        try:
+            tracker.decode_fused(pieces_points)
+        except Exception as e:
+            print(f'{path}: {e}')
+            failed.append(path)
+            continue
+        if on_frame is not None:
+            on_frame(path, tracker)
+
+    replay = chess.Board()
+    fens = [replay.fen()]
+    for move in tracker.game.move_stack:
+        replay.push(move)
+        fens.append(replay.fen())
+
+    pgn_game = chess.pgn.Game.from_board(tracker.game)
+    pgn_game.headers['Event'] = os.path.basename(os.path.normpath(game_directory))
+    return str(pgn_game), fens, failed
+
+
+# Every worker process runs inference on its share of the CPU cores, instead of all of them competing for every core
+def init_worker(threads):
+    config.settings.set('PREDICTOR.ONNX.INTRA_OP_THREADS', threads)
+    torch.set_num_threads(threads)
+
+
+def reconstruct_to_files(game_directory, batch_size=8):
+    pgn, fens, failed = reconstruct(game_directory, batch_size)
+    with open(os.path.join(game_directory, 'game.pgn'), 'w') as f:
+        f.write(pgn + '\n')
+    with open(os.path.join(game_directory, 'positions.fen'), 'w') as f:
+        f.write('\n'.join(fens) + '\n')
+    return game_directory, len(fens) - 1, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Reconstruct games from saved game directories, writing game.pgn and positions.fen (one FEN per '
+                    'ply) into each directory.'
+    )
+    parser.add_argument('directories', nargs='*', help='game directories, e.g. games/20240101-1200')
+    parser.add_argument('--all', metavar='ROOT', help='reconstruct every game directory below ROOT, e.g. games')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='games reconstructed in parallel, each worker loads its own models')
+    parser.add_argument('--batch-size', type=int, default=8, help='frames per detector batch')
+    args = parser.parse_args()
+
+    directories = list(args.directories)
+    if args.all is not None:
+        directories += sorted(path for path in glob.glob(f'{args.all}/*') if os.path.isdir(path))
+
+    # Every worker process loads its own models, games are independent of each other
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(threads,)) as executor:
+        futures = [executor.submit(reconstruct_to_files, directory, args.batch_size) for directory in directories]
+        for directory, future in zip(directories, futures):
+            try:
+                directory, plies, failed = future.result()
+                print(f'{directory}: {plies} plies, {len(failed)} frames without a move')
+            except Exception as e:
+                print(f'{directory}: failed ({e})')
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def frame_hash(img):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((img.shape, img.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.hexdigest()
+
+
+def config_hash(stage_config):
+    return hashlib.blake2b(json.dumps(stage_config, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+
+
+class ResultCache:
+    """Results of pipeline stages keyed by frame content hash and stage configuration hash.
+
+    Values are dicts of numpy arrays. They are kept in an in-memory LRU bounded by `max_bytes` and, when
+    `directory` is given, also written to `<directory>/<stage>/<key>.npz`, so replays of the same frames
+    skip the stage even across runs.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _disk_path(self, stage, key):
+        return os.path.join(self.directory, stage, key + '.npz')
+
+    def _get(self, stage, key):
+        with self.lock:
+            if (stage, key) in self.entries:
+                self.entries.move_to_end((stage, key))
+                return self.entries[(stage, key)][0]
+
+        if self.directory is not None and os.path.exists(self._disk_path(stage, key)):
+            with np.load(self._disk_path(stage, key), allow_pickle=False) as data:
+                value = {name: data[name] for name in data.files}
+            self._put_memory(stage, key, value)
+            return value
+
+        return None
+
+    def _put_memory(self, stage, key, value):
+        size = sum(array.nbytes for array in value.values())
+        with self.lock:
+            if (stage, key) in self.entries:
+                return
+            self.entries[(stage, key)] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def _put(self, stage, key, value):
+        self._put_memory(stage, key, value)
+
+        if self.directory is not None:
+            path = self._disk_path(stage, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name of its own first, so a crash never leaves a truncated entry behind
+            # and threads storing the same key do not write into the same file
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp.npz', delete=False) as f:
+                np.savez(f, **value)
+            os.replace(f.name, path)
+
+    def get_or_compute(self, stage, img, stage_config, compute):
+        key = frame_hash(img) + '-' + config_hash(stage_config)
+
+        value = self._get(stage, key)
+        with self.lock:
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if value is not None:
+            return value
+
+        value = {name: np.asarray(array) for name, array in compute().items()}
+        self._put(stage, key, value)
+        return value
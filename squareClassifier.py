@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+import torch
+from torch import nn
+
+from chesscog.core.models import MODELS_REGISTRY
+from chesscog.core.registry import Registry
+from detections import Detections
+
+#: Models for classifying single square crops, registered with chesscog's model registry like its piece classifiers
+SQUARE_CLASSIFIER_REGISTRY = Registry()
+MODELS_REGISTRY.register(SQUARE_CLASSIFIER_REGISTRY, 'SQUARE_CLASSIFIER')
+
+# torchvision ImageFolder assigns class ids in sorted folder name order
+CLASS_NAMES = sorted([
+    'empty',
+    'white-pawn', 'white-knight', 'white-bishop', 'white-rook', 'white-queen', 'white-king',
+    'black-pawn', 'black-knight', 'black-bishop', 'black-rook', 'black-queen', 'black-king',
+])
+EMPTY_CLASS = CLASS_NAMES.index('empty')
+
+# Same normalization as chesscog.core.dataset.transforms
+_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+@SQUARE_CLASSIFIER_REGISTRY.register
+class SquareCNN(nn.Module):
+    """Small CNN classifying a square crop (with headroom for tall pieces) as empty or one of the 12 pieces.
+    """
+
+    input_size = 50, 100
+    pretrained = False
+
+    def __init__(self):
+        super().__init__()
+        self.features = nn.Sequential(
+            nn.Conv2d(3, 16, 3, padding=1), nn.ReLU(inplace=True), nn.MaxPool2d(2),
+            nn.Conv2d(16, 32, 3, padding=1), nn.ReLU(inplace=True), nn.MaxPool2d(2),
+            nn.Conv2d(32, 64, 3, padding=1), nn.ReLU(inplace=True), nn.MaxPool2d(2),
+            nn.Conv2d(64, 64, 3, padding=1), nn.ReLU(inplace=True), nn.AdaptiveAvgPool2d(1),
+        )
+        self.classifier = nn.Linear(64, len(CLASS_NAMES))
+
+    def forward(self, x):
+        return self.classifier(torch.flatten(self.features(x), 1))
+
+
+# Source quadrilateral of a square crop: the square itself extended upwards (in the image) by `headroom`
+# square heights, ordered top left, top right, bottom right, bottom left
+def _crop_quad(square_coords, headroom):
+    corners = np.float32(square_coords)
+    corners = corners[corners[:, 1].argsort()]
+    top = corners[:2][corners[:2, 0].argsort()]
+    bottom = corners[2:][corners[2:, 0].argsort()]
+
+    height = bottom[:, 1].mean() - top[:, 1].mean()
+    top = top - np.float32([0, height * headroom])
+    return np.float32([top[0], top[1], bottom[1], bottom[0]])
+
+
+def crop_squares(img, board, crop_size=SquareCNN.input_size, headroom=1.0):
+    """Warp every square of `board` (plus headroom above it) to a fixed-size crop.
+
+    Returns the square coordinates (e.g. 'e4') and the crops as an array of shape (64, height, width, 3).
+    """
+    width, height = crop_size
+    destination = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+
+    coords = []
+    crops = np.empty((len(board.board), height, width, 3), dtype=np.uint8)
+    for i, (coord, square) in enumerate(board.board.items()):
+        transform = cv2.getPerspectiveTransform(_crop_quad(square.square_coords, headroom), destination)
+        cv2.warpPerspective(img, transform, (width, height), dst=crops[i], flags=cv2.INTER_LINEAR)
+        coords.append(coord)
+
+    return coords, crops
+
+
+class SquareClassifier:
+    """Classifies all 64 squares of an initialized `Board` in one batch instead of running full frame detection.
+
+    The output is a `Detections` with one entry per occupied square, placed at the square center, so it can
+    be passed to `Board.get_changed_squares` in place of `Predictor` results.
+    """
+
+    def __init__(self, weights_path, model_name='SquareCNN', headroom=1.0, device='cpu'):
+        self.device = torch.device(device)
+        self.headroom = headroom
+
+        # chesscog's train_model saves the whole module, a state dict is accepted as well
+        checkpoint = torch.load(weights_path, map_location=self.device, weights_only=False)
+        if isinstance(checkpoint, nn.Module):
+            self.model = checkpoint
+        else:
+            self.model = SQUARE_CLASSIFIER_REGISTRY[model_name]()
+            self.model.load_state_dict(checkpoint)
+        self.model.to(self.device)
+        self.model.eval()
+        self.crop_size = self.model.input_size
+
+    def _to_batch(self, crops):
+        # BGR -> RGB
+        batch = (crops[..., ::-1].astype(np.float32) / 255.0 - _MEAN) / _STD
+        return torch.from_numpy(batch.transpose(0, 3, 1, 2).copy()).to(self.device)
+
+    def classify(self, img, board):
+        coords, crops = crop_squares(img, board, self.crop_size, self.headroom)
+        with torch.no_grad():
+            probabilities = torch.softmax(self.model(self._to_batch(crops)), dim=1).cpu().numpy()
+        return coords, probabilities
+
+    def detect(self, img, board):
+        coords, probabilities = self.classify(img, board)
+        classes = probabilities.argmax(axis=1)
+        confidences = probabilities[np.arange(len(classes)), classes]
+        occupied = classes != EMPTY_CLASS
+
+        squares = [board.board[coord].square_coords for coord, is_occupied in zip(coords, occupied) if is_occupied]
+        quads = np.float32(squares).reshape(-1, 4, 2)
+        centers = quads.mean(axis=1)
+        xyxy = np.concatenate([quads.min(axis=1), quads.max(axis=1)], axis=1)
+
+        return Detections(
+            centers[:, 0].astype(np.int32),
+            centers[:, 1].astype(np.int32),
+            classes[occupied].astype(np.int32),
+            confidences[occupied].astype(np.float32),
+            CLASS_NAMES,
+            xyxy
+        )
@@ -0,0 +1,84 @@
+import argparse
+import os
+import shutil
+from pathlib import Path
+
+import chess
+import cv2
+from recap import URI, CfgNode as CN
+from recap.path_manager import register_translator
+
+from board.piece import piece_from_chess, piece_name
+from chesscog.core.training import train
+from reconstruct import reconstruct
+from squareClassifier import SquareCNN, crop_squares
+
+# URI schemes used by chesscog's training code. The dataset is written below `data/` unless DATA_DIR says otherwise
+register_translator('config', Path(__file__).parent / 'config')
+register_translator('data', Path(os.getenv('DATA_DIR', Path(__file__).parent / 'data')))
+register_translator('runs', Path(__file__).parent / 'runs')
+
+DATASET = 'data://square_classifier'
+CONFIG = 'config://square_classifier/{model}.yaml'
+RUN = 'runs://square_classifier/{model}'
+
+
+def export_crops(game_directory, split, headroom=1.0):
+    """Write the square crops of every decoded frame of a saved game into the ImageFolder dataset.
+
+    Every crop is labelled with the piece standing on its square in the reconstructed game, so frames whose move
+    could not be decoded are left out. Returns the number of crops written.
+    """
+    game = os.path.basename(os.path.normpath(game_directory))
+    split_dir = URI(DATASET) / split
+    written = 0
+
+    def on_frame(path, tracker):
+        nonlocal written
+        frame = os.path.basename(path)[:-4]
+        coords, crops = crop_squares(cv2.imread(path), tracker.board, SquareCNN.input_size, headroom)
+        for coord, crop in zip(coords, crops):
+            label = piece_name(piece_from_chess(tracker.game.piece_at(chess.parse_square(coord))))
+            label_dir = split_dir / label
+            label_dir.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(str(label_dir / f'{game}_{frame}_{coord}.png'), crop)
+            written += 1
+
+    reconstruct(game_directory, on_frame=on_frame)
+    return written
+
+
+def train_square_classifier(model='SquareCNN', weights=None):
+    """Train the square classifier with chesscog's training loop and copy the saved module to `weights`."""
+    cfg = CN.load_yaml_with_base(URI(CONFIG.format(model=model)))
+    run_dir = URI(RUN.format(model=model))
+    train(cfg, run_dir)
+
+    if weights is not None:
+        shutil.copyfile(run_dir / f'{model}.pt', weights)
+        print(f'Saved {weights}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export labelled square crops from saved games and train the square classifier on them.'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='write square crops of reconstructed games to the dataset')
+    export_parser.add_argument('directories', nargs='+', help='game directories, e.g. games/20240101-1200')
+    export_parser.add_argument('--split', choices=['train', 'val', 'test'], default='train')
+    export_parser.add_argument('--headroom', type=float, default=1.0,
+                               help='square heights above every square, must match SQUARE_CLASSIFIER.HEADROOM')
+
+    train_parser = subparsers.add_parser('train', help='train on the exported dataset')
+    train_parser.add_argument('--model', default='SquareCNN', help='config in config/square_classifier')
+    train_parser.add_argument('--weights', default='models/square_classifier.pt',
+                              help='where to copy the trained model, SQUARE_CLASSIFIER.WEIGHTS loads it from there')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        for directory in args.directories:
+            print(f'{directory}: {export_crops(directory, args.split, args.headroom)} crops')
+    else:
+        train_square_classifier(args.model, args.weights)
@@ -8,9 +8,9 @@ if __name__ == '__main__':
     webcam = VideoCapture(config.settings.CAMERA_URL)
 
     while True:
-        frame = webcam.read()
+        frame, age = webcam.read()
         if frame is None:
             print('bad')
-            continue
+            break
 
-        model(frame, iou=0.2, conf=0.5, show=True, line_width=2, show_labels=True)
+        model(frame.image, iou=0.2, conf=0.5, show=True, line_width=2, show_labels=True)
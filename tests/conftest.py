@@ -0,0 +1,40 @@
+import os
+import sys
+
+import chess
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detections import Detections
+
+NAMES = ['white-pawn', 'white-knight', 'white-bishop', 'white-rook', 'white-queen', 'white-king',
+         'black-pawn', 'black-knight', 'black-bishop', 'black-rook', 'black-queen', 'black-king']
+SQUARE_SIZE = 60
+OFFSET = 20
+# 81 corners of an axis aligned board seen from white, a8 in the top left corner of the image
+CORNERS = [[SQUARE_SIZE * h + OFFSET, SQUARE_SIZE * v + OFFSET] for h in range(9) for v in range(9)]
+
+
+def square_center(square):
+    x = SQUARE_SIZE * chess.square_file(square) + OFFSET + SQUARE_SIZE // 2
+    y = SQUARE_SIZE * (7 - chess.square_rank(square)) + OFFSET + SQUARE_SIZE // 2
+    return x, y
+
+
+def detections_for(game):
+    """Detections of every piece of `game`, with the base point of each box inside its square."""
+    xyxy, classes = [], []
+    for square, chess_piece in game.piece_map().items():
+        x, y = square_center(square)
+        xyxy.append([x - 20, y - 50, x + 20, y + 15])
+        name = ('white' if chess_piece.color == chess.WHITE else 'black') + '-' + chess.piece_name(chess_piece.piece_type)
+        classes.append(NAMES.index(name))
+    return Detections.from_boxes(np.array(xyxy, dtype=np.float32), classes, [0.9] * len(classes), NAMES)
+
+
+@pytest.fixture
+def board():
+    from board.boardState import Board
+    return Board(CORNERS, 'white', 'white')
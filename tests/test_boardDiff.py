@@ -0,0 +1,53 @@
+import chess
+import numpy as np
+
+from boardDiff import BoardDiff, match_move, move_squares
+from conftest import CORNERS
+
+
+def test_move_squares_castling():
+    game = chess.Board('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+    assert move_squares(chess.Move.from_uci('e1g1'), game) == {chess.E1, chess.F1, chess.G1, chess.H1}
+    assert move_squares(chess.Move.from_uci('e1c1'), game) == {chess.A1, chess.C1, chess.D1, chess.E1}
+
+
+def test_move_squares_en_passant():
+    game = chess.Board('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1')
+    assert move_squares(chess.Move.from_uci('e5d6'), game) == {chess.E5, chess.D5, chess.D6}
+
+
+def test_match_move_exact():
+    assert match_move(['e2', 'e4'], chess.Board()) == chess.Move.from_uci('e2e4')
+
+
+def test_match_move_castling():
+    game = chess.Board('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+    assert match_move(['e1', 'f1', 'g1', 'h1'], game) == chess.Move.from_uci('e1g1')
+
+
+def test_match_move_needs_every_changed_square_explained():
+    game = chess.Board()
+    # A shadow on h3 next to the move
+    assert match_move(['e2', 'e4', 'h3'], game) is None
+    # A weak difference on the to square
+    assert match_move(['e2'], game) is None
+    assert match_move([], game) is None
+
+
+def test_match_move_promotion_is_ambiguous():
+    game = chess.Board('8/P6k/8/8/8/8/8/K7 w - - 0 1')
+    assert match_move(['a7', 'a8'], game) is None
+
+
+def test_board_diff_reference_after_reset(board):
+    board_diff = BoardDiff(CORNERS, board.grid_coords, square_size=16)
+    img = np.full((600, 600, 3), 128, dtype=np.uint8)
+    board_diff.set_reference(img)
+
+    board_diff.reset()
+    assert board_diff.reference is None
+    # The next frame only becomes the reference once its move is committed
+    board_diff.set_pending(img)
+    assert board_diff.reference is None
+    board_diff.commit()
+    assert board_diff.candidates(img) == ([], [])
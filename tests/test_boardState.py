@@ -0,0 +1,99 @@
+import chess
+
+from board.piece import Piece
+from conftest import detections_for
+
+
+def play(board, game, uci):
+    move = chess.Move.from_uci(uci)
+    board.update_board(board.squares_for_move(move, game))
+    game.push(move)
+
+
+def test_initial_board_matches_game(board):
+    assert board.matches_game(chess.Board())
+
+
+def test_update_board_follows_the_game(board):
+    game = chess.Board()
+    for uci in ['e2e4', 'd7d5', 'e4d5', 'g8f6', 'g1f3', 'f6d5', 'f1c4', 'c8g4', 'e1g1']:
+        play(board, game, uci)
+        assert board.matches_game(game)
+    assert board.get_square('g1').piece == Piece.whiteKing
+    assert board.get_square('f1').piece == Piece.whiteRook
+
+
+def test_changed_bitboards(board):
+    game = chess.Board()
+    game.push_uci('e2e4')
+    assert board.changed_bitboards(detections_for(game)) == (chess.BB_E4, chess.BB_E2, 0)
+    assert board.observed_bitboards(detections_for(game)) == (
+        game.occupied, game.occupied_co[chess.WHITE], game.occupied_co[chess.BLACK]
+    )
+
+
+def test_changed_bitboards_capture_recolors_a_square(board):
+    game = chess.Board()
+    for uci in ['e2e4', 'd7d5']:
+        play(board, game, uci)
+    game.push_uci('e4d5')
+    assert board.changed_bitboards(detections_for(game)) == (0, chess.BB_E4, chess.BB_D5)
+
+
+def test_rollback(board):
+    game = chess.Board()
+    for uci in ['e2e4', 'e7e5', 'g1f3']:
+        play(board, game, uci)
+
+    assert board.rollback(2)
+    game.pop()
+    game.pop()
+    assert board.matches_game(game)
+    assert len(board.history) == 1
+
+    assert board.rollback()
+    assert board.matches_game(chess.Board())
+    assert not board.rollback()
+
+
+def test_snapshot_is_copy_on_write(board):
+    game = chess.Board()
+    snapshot = board.snapshot()
+    pieces = snapshot[0].copy()
+    assert snapshot[0] is board.pieces
+
+    play(board, game, 'e2e4')
+    # The first write after the snapshot copies the shared piece array
+    assert snapshot[0] is not board.pieces
+    assert (snapshot[0] == pieces).all()
+    assert board.history[-1][0] is snapshot[0]
+
+    board.restore(snapshot)
+    assert board.matches_game(chess.Board())
+    play(board, chess.Board(), 'd2d4')
+    assert (snapshot[0] == pieces).all()
+
+
+def test_changed_bitboards_against_a_snapshot(board):
+    game = chess.Board()
+    snapshot = board.snapshot()
+    play(board, game, 'e2e4')
+
+    appeared, vanished, recolored = board.changed_bitboards(detections_for(game), snapshot)
+    assert (appeared, vanished, recolored) == (chess.BB_E4, chess.BB_E2, 0)
+    assert board.changed_bitboards(detections_for(game)) == (0, 0, 0)
+
+
+def test_find_earlier_position(board):
+    game = chess.Board()
+    positions = [game.copy()]
+    for uci in ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4']:
+        play(board, game, uci)
+        positions.append(game.copy())
+
+    assert board.find_earlier_position(detections_for(positions[-2])) == 1
+    assert board.find_earlier_position(detections_for(positions[-3])) == 2
+    assert board.find_earlier_position(detections_for(positions[0])) == 5
+    assert board.find_earlier_position(detections_for(positions[0]), max_plies=4) is None
+    # The current position is not an earlier one
+    assert board.find_earlier_position(detections_for(positions[-1])) is None
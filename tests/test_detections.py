@@ -0,0 +1,31 @@
+import numpy as np
+
+from detections import Detections, bounding_box_bottom_middle
+
+
+def test_from_boxes_matches_bounding_box_bottom_middle():
+    rng = np.random.default_rng(0)
+    top_left = rng.uniform(0, 1800, size=(200, 2))
+    xyxy = np.hstack([top_left, top_left + rng.uniform(1, 200, size=(200, 2))]).astype(np.float32)
+    detections = Detections.from_boxes(xyxy, np.zeros(len(xyxy)), np.ones(len(xyxy)), ['white-pawn'])
+
+    for i, (x, y, x1, y1) in enumerate(xyxy):
+        # The boxes used to be truncated to integers before taking their base point
+        expected = bounding_box_bottom_middle([int(x), int(y)], [int(x1), int(y1)])
+        assert [int(detections.x[i]), int(detections.y[i])] == expected
+        assert detections[i].point == expected
+
+
+def test_empty():
+    detections = Detections.empty(['white-pawn'])
+    assert len(detections) == 0
+    assert detections.xyxy.shape == (0, 4)
+
+
+def test_arrays_round_trip():
+    detections = Detections.from_boxes([[10, 20, 30, 80], [50, 60, 70, 90]], [0, 1], [0.5, 0.9],
+                                       ['white-pawn', 'black-pawn'])
+    restored = Detections.from_arrays(detections.to_arrays())
+    assert restored.names == detections.names
+    for name in ('x', 'y', 'cls', 'conf', 'xyxy'):
+        assert np.array_equal(getattr(restored, name), getattr(detections, name))
@@ -0,0 +1,136 @@
+import chess
+import pytest
+
+from conftest import CORNERS, detections_for
+
+# Needs the full set of dependencies (models, GUI and corner detection packages) to import
+gameTracker = pytest.importorskip('gameTracker')
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = gameTracker.ChessGameTracker(str(tmp_path), None)
+    tracker.cache = None
+    tracker.game = chess.Board()
+    tracker.board_corners = [CORNERS[0], CORNERS[8], CORNERS[80], CORNERS[72]]
+    tracker.square_corners = CORNERS
+    tracker.create_board(None, 'white', 'white')
+    return tracker
+
+
+def play(tracker, moves):
+    for uci in moves:
+        tracker.apply_move(chess.Move.from_uci(uci))
+
+
+def test_undo_move(tracker):
+    play(tracker, ['e2e4', 'e7e5'])
+    assert tracker.undo_move() == chess.Move.from_uci('e7e5')
+    assert [move.uci() for move in tracker.game.move_stack] == ['e2e4']
+    assert tracker.board.matches_game(tracker.game)
+
+    assert tracker.undo_move() == chess.Move.from_uci('e2e4')
+    assert tracker.undo_move() is None
+    assert tracker.board.matches_game(chess.Board())
+
+
+def take_back_position(tracker, plies):
+    position = tracker.game.copy()
+    for i in range(plies):
+        position.pop()
+    return position
+
+
+@pytest.mark.parametrize('plies', [1, 2])
+def test_take_back(tracker, plies):
+    play(tracker, ['e2e4', 'e7e5', 'g1f3'])
+    position = take_back_position(tracker, plies)
+
+    assert tracker.take_back(detections_for(position))
+    assert tracker.game.move_stack == position.move_stack
+    assert tracker.board.matches_game(tracker.game)
+
+
+def test_take_back_stops_at_max_plies(tracker):
+    play(tracker, ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4'])
+    assert len(tracker.game.move_stack) > gameTracker.config.settings.TAKEBACK.MAX_PLIES
+
+    assert not tracker.take_back(detections_for(chess.Board()))
+    assert len(tracker.game.move_stack) == 5
+
+
+def test_take_back_after_restore(tracker, tmp_path):
+    play(tracker, ['e2e4', 'e7e5'])
+    tracker.make_game_directory()
+    tracker.save_state()
+
+    restored = gameTracker.ChessGameTracker(str(tmp_path), None)
+    restored.cache = None
+    assert restored.restore_state()
+    # The restored board replays the saved moves, so they can be taken back
+    assert restored.take_back(detections_for(chess.Board()))
+    assert len(restored.game.move_stack) == 0
+    assert not restored.take_back(detections_for(chess.Board()))
+
+
+def test_take_back_does_not_pop_more_moves_than_played(tracker):
+    play(tracker, ['e2e4', 'e7e5'])
+    # Continued from a position, the board history reaches further back than the move stack
+    tracker.game = tracker.game.copy(stack=False)
+    play(tracker, ['g1f3'])
+
+    assert not tracker.take_back(detections_for(chess.Board()))
+    assert tracker.board.matches_game(tracker.game)
+
+
+def position_after(game, moves):
+    position = game.copy()
+    for uci in moves:
+        position.push_uci(uci)
+    return position
+
+
+def test_catch_up_two_plies(tracker, capsys):
+    play(tracker, ['e2e4'])
+    assert tracker.catch_up(detections_for(position_after(tracker.game, ['e7e5', 'g1f3']))) == \
+        chess.Move.from_uci('g1f3')
+    assert [move.uci() for move in tracker.game.move_stack] == ['e2e4', 'e7e5', 'g1f3']
+    assert tracker.board.matches_game(tracker.game)
+    # Every ply is logged, so a wrong guess can be undone
+    assert 'Caught up ply 1/2: 1 e5' in capsys.readouterr().out
+
+
+def test_catch_up_rejects_a_single_ply(tracker):
+    assert tracker.catch_up(detections_for(position_after(tracker.game, ['e2e4']))) is None
+    assert len(tracker.game.move_stack) == 0
+
+
+def test_catch_up_needs_a_margin_over_the_best_single_move(tracker, monkeypatch):
+    observed = detections_for(position_after(tracker.game, ['e2e4']))
+    moves = [chess.Move.from_uci('e2e4'), chess.Move.from_uci('e7e5')]
+
+    # A sequence explaining the detections no better than e2e4 alone
+    monkeypatch.setattr(gameTracker, 'catch_up', lambda *args, **kwargs: (moves, 0.0))
+    assert tracker.catch_up(observed) is None
+    assert len(tracker.game.move_stack) == 0
+
+    monkeypatch.setattr(gameTracker, 'catch_up', lambda *args, **kwargs: (moves, 100.0))
+    assert tracker.catch_up(observed) == chess.Move.from_uci('e7e5')
+    assert tracker.game.move_stack == moves
+
+
+class NoFrameWebcam:
+    def read(self, timeout=None):
+        return None, None
+
+
+def test_grab_frame_without_a_frame(tracker):
+    tracker._webcam = NoFrameWebcam()
+    assert tracker.grab_frame() is None
+
+
+def test_decode_fused_without_another_frame(tracker):
+    # Nothing moved, so fusion asks for another frame which the camera does not deliver
+    with pytest.raises(ValueError):
+        tracker.decode_fused(detections_for(tracker.game), lambda: None)
+    assert len(tracker.game.move_stack) == 0
@@ -0,0 +1,168 @@
+import chess
+import numpy as np
+
+from moveDecoder import MoveTable, catch_up, change_signature, decode_legal_move, move_changes, piece_class, \
+    position_classes, score_moves
+
+
+def observed_log_likelihood(position, confidence=0.9):
+    """Log-likelihood of observing `position`, every square showing its piece with `confidence`."""
+    likelihood = np.full((64, 13), (1 - confidence) / 12)
+    likelihood[np.arange(64), position_classes(position)] = confidence
+    return np.log(likelihood)
+
+
+def after(game, uci):
+    position = game.copy(stack=False)
+    position.push_uci(uci)
+    return position
+
+
+def test_move_changes_kingside_castling():
+    game = chess.Board('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+    changes = move_changes(chess.Move.from_uci('e1g1'), game)
+    assert sorted(changes) == sorted([
+        (chess.E1, 0), (chess.H1, 0),
+        (chess.G1, piece_class(chess.Piece(chess.KING, chess.WHITE))),
+        (chess.F1, piece_class(chess.Piece(chess.ROOK, chess.WHITE)))
+    ])
+
+
+def test_move_changes_queenside_castling():
+    game = chess.Board('r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1')
+    changes = move_changes(chess.Move.from_uci('e8c8'), game)
+    assert sorted(changes) == sorted([
+        (chess.E8, 0), (chess.A8, 0),
+        (chess.C8, piece_class(chess.Piece(chess.KING, chess.BLACK))),
+        (chess.D8, piece_class(chess.Piece(chess.ROOK, chess.BLACK)))
+    ])
+
+
+def test_move_changes_en_passant():
+    game = chess.Board('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1')
+    changes = move_changes(chess.Move.from_uci('e5d6'), game)
+    assert sorted(changes) == sorted([
+        (chess.E5, 0), (chess.D5, 0), (chess.D6, piece_class(chess.Piece(chess.PAWN, chess.WHITE)))
+    ])
+
+
+def test_move_changes_promotion():
+    game = chess.Board('8/P6k/8/8/8/8/8/K7 w - - 0 1')
+    changes = move_changes(chess.Move.from_uci('a7a8n'), game)
+    assert sorted(changes) == sorted([(chess.A7, 0), (chess.A8, piece_class(chess.Piece(chess.KNIGHT, chess.WHITE)))])
+
+
+def test_move_changes_match_the_position_after_the_move():
+    game = chess.Board('r3k2r/1P6/8/3pP3/8/8/8/R3K2R w KQkq d6 0 1')
+    for move in game.legal_moves:
+        changed = position_classes(after(game, move.uci())) != position_classes(game)
+        assert sorted(square for square, new_class in move_changes(move, game)) == list(np.flatnonzero(changed))
+
+
+def test_score_moves_prefers_the_observed_move():
+    for fen, uci in [
+        ('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1', 'e1g1'),
+        ('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1', 'e1c1'),
+        ('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1', 'e5d6'),
+        ('8/P6k/8/8/8/8/8/K7 w - - 0 1', 'a7a8q'),
+        ('8/P6k/8/8/8/8/8/K7 w - - 0 1', 'a7a8n'),
+    ]:
+        game = chess.Board(fen)
+        moves, scores = score_moves(observed_log_likelihood(after(game, uci)), game)
+        assert moves[int(np.argmax(scores))].uci() == uci
+
+
+def test_score_moves_scores_given_moves_only():
+    game = chess.Board()
+    moves = [chess.Move.from_uci('e2e4'), chess.Move.from_uci('d2d4')]
+    scored, scores = score_moves(observed_log_likelihood(after(game, 'd2d4')), game, moves)
+    assert scored == moves
+    assert scores.shape == (2,)
+    assert scores[1] > 0 > scores[0]
+
+
+def test_decode_legal_move_margin():
+    game = chess.Board()
+    best, margin, runner_up = decode_legal_move(observed_log_likelihood(after(game, 'e2e4')), game)
+    assert best == chess.Move.from_uci('e2e4')
+    assert margin > 0
+
+    # No move at all explains an unchanged board better than any move
+    best, margin, runner_up = decode_legal_move(observed_log_likelihood(game), game)
+    assert margin < 0
+
+
+def play(game, moves):
+    position = game.copy()
+    for uci in moves:
+        position.push_uci(uci)
+    return position
+
+
+def test_catch_up_two_plies():
+    game = chess.Board()
+    moves, gain = catch_up(observed_log_likelihood(play(game, ['e2e4', 'e7e5'])), game)
+    assert [move.uci() for move in moves] == ['e2e4', 'e7e5']
+    assert gain > 0
+
+
+def test_catch_up_three_plies():
+    game = play(chess.Board(), ['e2e4', 'e7e5'])
+    moves, gain = catch_up(observed_log_likelihood(play(game, ['g1f3', 'b8c6', 'f1c4'])), game)
+    assert [move.uci() for move in moves] == ['g1f3', 'b8c6', 'f1c4']
+
+
+def test_catch_up_prefers_the_shorter_sequence():
+    game = chess.Board()
+    moves, gain = catch_up(observed_log_likelihood(play(game, ['d2d4'])), game)
+    assert [move.uci() for move in moves] == ['d2d4']
+
+
+def test_catch_up_without_a_change():
+    game = chess.Board()
+    assert catch_up(observed_log_likelihood(game), game) == ([], 0.0)
+
+
+def test_catch_up_through_a_mate():
+    # Fool's mate, the mated position ends up in the beam without any legal move to expand
+    game = play(chess.Board(), ['f2f3', 'e7e5'])
+    moves, gain = catch_up(observed_log_likelihood(play(game, ['g2g4', 'd8h4'])), game, max_plies=3)
+    assert [move.uci() for move in moves] == ['g2g4', 'd8h4']
+
+    mated = play(game, ['g2g4', 'd8h4'])
+    assert catch_up(observed_log_likelihood(mated), mated) == ([], 0.0)
+
+
+def test_move_table_exact_lookup():
+    game = chess.Board()
+    table = MoveTable(game)
+    assert table.key == chess.polyglot.zobrist_hash(game)
+    assert table.lookup(change_signature(game, after(game, 'g1f3'))) == [chess.Move.from_uci('g1f3')]
+
+
+def test_move_table_promotions_share_a_signature():
+    game = chess.Board('8/P6k/8/8/8/8/8/K7 w - - 0 1')
+    moves = MoveTable(game).lookup(change_signature(game, after(game, 'a7a8q')))
+    assert sorted(move.uci() for move in moves) == ['a7a8b', 'a7a8n', 'a7a8q', 'a7a8r']
+
+
+def test_move_table_repairs_one_spurious_change():
+    game = chess.Board()
+    appeared, vanished, recolored = change_signature(game, after(game, 'e2e4'))
+    # A hand over h3 shows up as a piece there
+    signature = (appeared | chess.BB_H3, vanished, recolored)
+    assert MoveTable(game).lookup(signature) == [chess.Move.from_uci('e2e4')]
+
+
+def test_move_table_does_not_repair_two_spurious_changes():
+    game = chess.Board()
+    appeared, vanished, recolored = change_signature(game, after(game, 'e2e4'))
+    signature = (appeared | chess.BB_H3 | chess.BB_A3, vanished, recolored)
+    assert MoveTable(game).lookup(signature) == []
+
+
+def test_move_table_does_not_guess_between_repairs():
+    game = chess.Board()
+    # e2 emptied and a pawn seen on both e3 and e4, either one could be spurious
+    signature = (chess.BB_E3 | chess.BB_E4, chess.BB_E2, 0)
+    assert MoveTable(game).lookup(signature) == []
@@ -1,30 +1,120 @@
 import threading
-from queue import Queue
+import time
 
 import cv2
+import numpy as np
+
+
+class Frame:
+    __slots__ = ('image', 'seq', 'timestamp')
+
+    def __init__(self, image, seq=0, timestamp=0.0):
+        self.image = image
+        self.seq = seq
+        self.timestamp = timestamp
 
 
 class VideoCapture:
 
-    def __init__(self, name):
+    # A frame returned by read() stays untouched until the next read() call, so the pool needs at least
+    # three slots: one being written, the newest published one and the one held by the consumer.
+    def __init__(self, name, pool_size=4):
+        if pool_size < 3:
+            raise ValueError('pool_size must be at least 3')
+
         self.cap = cv2.VideoCapture(name)
-        self.q = Queue()
+        self.pool_size = pool_size
+        self.pool = []
+        self.latest = None
+        self.leased = None
+        self.seq = 0
+        self.served_seq = 0
+        self.stopped = False
+
+        self.dropped_frames = 0
+        self.stale_frames = 0
+        self.served_frames = 0
+
+        self.condition = threading.Condition()
         t = threading.Thread(target=self._reader)
         t.daemon = True
         t.start()
 
-    # read frames as soon as they are available, keeping only most recent one
+    def _allocate_pool(self, first_image):
+        self.pool = [Frame(first_image)]
+        for _ in range(self.pool_size - 1):
+            self.pool.append(Frame(np.empty_like(first_image)))
+
+    def _next_free_slot(self):
+        for frame in self.pool:
+            if frame is not self.latest and frame is not self.leased:
+                return frame
+
+    # read frames as soon as they are available into preallocated buffers, keeping only most recent one
     def _reader(self):
-        while True:
-            ret, frame = self.cap.read()
+        ret, image = self.cap.read()
+        if ret:
+            with self.condition:
+                self._allocate_pool(image)
+                self._publish(self.pool[0])
+
+        while ret and not self.stopped:
+            with self.condition:
+                slot = self._next_free_slot()
+
+            ret, image = self.cap.read(image=slot.image)
             if not ret:
                 break
-            if not self.q.empty():
-                try:
-                    self.q.get_nowait()  # discard previous (unprocessed) frame
-                except Queue.Empty:
-                    pass
-            self.q.put(frame)
-
-    def read(self):
-        return self.q.get()
+            # cv2 allocates a new array if the camera changed resolution, adopt it as the slot's buffer
+            slot.image = image
+
+            with self.condition:
+                self._publish(slot)
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def _publish(self, frame):
+        self.seq += 1
+        if self.latest is not None and self.latest.seq > self.served_seq:
+            self.dropped_frames += 1
+        frame.seq = self.seq
+        frame.timestamp = time.monotonic()
+        self.latest = frame
+        self.condition.notify_all()
+
+    def read(self, timeout=None):
+        """Return the newest frame and its age in seconds without copying it.
+
+        Blocks until a frame newer than the previously served one arrives. When `timeout` expires first,
+        the previous frame is served again and counted as stale. Returns `(None, None)` once the capture
+        has stopped without producing any frame.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped or self.seq > self.served_seq, timeout)
+
+            frame = self.latest
+            if frame is None:
+                return None, None
+
+            if frame.seq <= self.served_seq:
+                self.stale_frames += 1
+            self.served_frames += 1
+            self.served_seq = frame.seq
+            self.leased = frame
+
+            return frame, time.monotonic() - frame.timestamp
+
+    def stats(self):
+        with self.condition:
+            return {
+                'captured': self.seq,
+                'served': self.served_frames,
+                'dropped': self.dropped_frames,
+                'stale': self.stale_frames,
+            }
+
+    def release(self):
+        self.stopped = True
+        self.cap.release()